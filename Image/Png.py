@@ -17,6 +17,10 @@ processing modules to be added post-facto).
 
 This Image plugin module can read and write .png files if PyPNG is
 installed. See http://pypi.python.org/pypi/pypng
+
+If numpy is installed the rows are read into (and written from) a
+height x width x 4 array of bytes which is converted to (or from) the
+ARGB pixels with a single byte-order view rather than pixel by pixel.
 """
 
 import os
@@ -32,6 +36,14 @@ try:
     import png
 except ImportError:
     png = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The order of the R, G, B, A bytes in a little-endian ARGB uint32 and
+# vice versa
+_BGRA = [2, 1, 0, 3]
 
 
 def can_load(filename):
@@ -52,24 +64,93 @@ if png is not None:
         """load a PNG file"""
         reader = png.Reader(filename=filename)
         image.width, image.height, pixels, _ = reader.asRGBA8()
+        if numpy is not None:
+            rgba = numpy.empty((image.height, image.width * 4),
+                    dtype=numpy.uint8)
+            for y, row in enumerate(pixels):
+                rgba[y] = numpy.frombuffer(row, dtype=numpy.uint8)
+            image.pixels = _argb_for_rgba(rgba)
+            return
         image.pixels = Image.create_array(image.width, image.height)
-        index = 0
-        for row in pixels:
-            for r, g, b, α in zip(row[::4], row[1::4], row[2::4], row[3::4]):
-                image.pixels[index] = Image.color_for_argb(α, r, g, b)
-                index += 1
+        rgba = b"".join(pixels)
+        image.set_channels(rgba[3::4], rgba[::4], rgba[1::4], rgba[2::4])
+
+
+    def load_header(image, filename):
+        """read a PNG file's width and height from its IHDR chunk"""
+        with open(filename, "rb") as file:
+            reader = png.Reader(file=file)
+            try:
+                reader.preamble()
+            except png.Error as err:
+                raise Image.Error("failed to parse '{}': {}".format(
+                        filename, err))
+            image.width = reader.width
+            image.height = reader.height
+
+
+    def load_rows(image, filename):
+        """yield a PNG file's rows as PyPNG decodes them"""
+        with open(filename, "rb") as file:
+            reader = png.Reader(file=file)
+            image.width, image.height, rows, _ = reader.asRGBA8()
+            for row in rows:
+                if numpy is not None:
+                    yield _argb_for_rgba(numpy.frombuffer(row,
+                            dtype=numpy.uint8).reshape(1, -1))
+                else:
+                    rgba = bytes(row)
+                    rowImage = Image.Image.create(image.width, 1)
+                    rowImage.set_channels(rgba[3::4], rgba[::4],
+                            rgba[1::4], rgba[2::4])
+                    yield rowImage.pixels
 
 
     def save(image, filename):
         """save a PNG file"""
         with open(filename, "wb") as file:
             writer = png.Writer(width=image.width, height=image.height,
-                    alpha=True)
-            writer.write_array(file, list(_rgba_for_pixels(image.pixels)))
+                    greyscale=False, alpha=True)
+            if numpy is not None and isinstance(image.pixels,
+                    numpy.ndarray):
+                writer.write(file, _rgba_for_argb(image.pixels,
+                        image.width, image.height))
+            else:
+                writer.write_array(file, _rgba_for_channels(image))
+
+
+    def save_rows(header, filename, rows):
+        """save a PNG file a row at a time; header has the width and
+        height"""
+        with open(filename, "wb") as file:
+            writer = png.Writer(width=header.width, height=header.height,
+                    greyscale=False, alpha=True)
+            writer.write(file, (_rgba_for_row(row, header.width)
+                                for row in rows))
+
+
+    def _argb_for_rgba(rgba):
+        bgra = numpy.ascontiguousarray(rgba.reshape(rgba.shape[0], -1,
+                4)[:, :, _BGRA])
+        return bgra.view("<u4").reshape(-1).astype(numpy.uint32,
+                copy=False)
+
+
+    def _rgba_for_argb(pixels, width, height):
+        bgra = pixels.astype("<u4", copy=False).view(numpy.uint8)
+        return bgra.reshape(height, width, 4)[:, :, _BGRA].reshape(
+                height, -1)
+
+
+    def _rgba_for_row(row, width):
+        if numpy is not None and isinstance(row, numpy.ndarray):
+            return _rgba_for_argb(row, width, 1)[0]
+        return _rgba_for_channels(Image.Image.from_data(width, row))
 
 
-    def _rgba_for_pixels(pixels):
-        for color in pixels:
-            α, r, g, b = Image.argb_for_color(color)
-            for component in (r, g, b, α):
-                yield component
+    def _rgba_for_channels(image):
+        α, r, g, b = image.channels()
+        rgba = bytearray(len(α) * 4)
+        for offset, channel in enumerate((r, g, b, α)):
+            rgba[offset::4] = channel
+        return rgba
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+    import Image
+Use the above rather than importing this module explicitly. This works
+because Image imports any modules it finds (to allow for new image
+processing modules to be added post-facto).
+
+This Image plugin module can read and write .argb files. These hold the
+pixels exactly as Image does, so they can be loaded without any per-pixel
+work, which makes them suitable for passing images between the stages
+of a pipeline (e.g., as a cache of decoded images).
+
+The format (all ints are little-endian) is the 4 bytes "ARGB", a 32-bit
+version (1), 32-bit width, 32-bit height, and 32-bit meta length,
+followed by the meta data as UTF-8 encoded JSON, padded with spaces to
+a multiple of 4 bytes, followed by width x height 32-bit ARGB pixels.
+
+(Note that these files have a header and so are not the same as the
+headerless files used by Image.from_backing().)
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_MAGIC = b"ARGB"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIIII")
+
+
+def can_load(filename):
+    """Returns 100 if this module can do a lossless load, 0 if it can't
+    load the file, and something inbetween if it can do a lossy load."""
+    return 100 if os.path.splitext(filename)[1].lower() == ".argb" else 0
+
+
+def can_save(filename):
+    """Returns 100 if this module can do a lossless save, 0 if it can't
+    save the file, and something inbetween if it can do a lossy save."""
+    return can_load(filename)
+
+
+def load(image, filename):
+    """load an ARGB file; with numpy the pixels are a copy-on-write
+    memory map of the file, so they're only read when accessed"""
+    with open(filename, "rb") as file:
+        offset = _read_header(image, file, filename)
+    count = image.width * image.height
+    if os.path.getsize(filename) < offset + (count * 4):
+        raise Image.Error("truncated ARGB file '{}'".format(filename))
+    if numpy is not None:
+        pixels = numpy.memmap(filename, dtype="<u4", mode="c",
+                offset=offset, shape=(count,))
+        image.pixels = pixels.astype(numpy.uint32, copy=False)
+        return
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as raw:
+            pixels = array.array(Image._typecode())
+            pixels.frombytes(raw[offset:offset + (count * 4)])
+    if sys.byteorder == "big":
+        pixels.byteswap()
+    image.pixels = pixels
+
+
+def load_header(image, filename):
+    """read an ARGB file's width, height, and meta data"""
+    with open(filename, "rb") as file:
+        _read_header(image, file, filename)
+
+
+def load_rows(image, filename):
+    """yield an ARGB file's rows, reading one row at a time"""
+    with open(filename, "rb") as file:
+        file.seek(_read_header(image, file, filename))
+        size = image.width * 4
+        for _ in range(image.height):
+            data = file.read(size)
+            if len(data) != size:
+                raise Image.Error("truncated ARGB file '{}'".format(
+                        filename))
+            yield _row_for_bytes(data)
+
+
+def _row_for_bytes(data):
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype="<u4").astype(numpy.uint32)
+    row = array.array(Image._typecode())
+    row.frombytes(data)
+    if sys.byteorder == "big":
+        row.byteswap()
+    return row
+
+
+def _read_header(image, file, filename):
+    header = file.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise Image.Error("failed to parse '{}'".format(filename))
+    magic, version, image.width, image.height, size = _HEADER.unpack(
+            header)
+    if magic != _MAGIC or version != _VERSION:
+        raise Image.Error("'{}' is not a version {} ARGB file".format(
+                filename, _VERSION))
+    try:
+        image.meta.update(json.loads(file.read(size).decode("utf-8")))
+    except ValueError as err:
+        raise Image.Error("invalid meta data in '{}': {}".format(filename,
+                err))
+    return _HEADER.size + _padded(size)
+
+
+def save(image, filename):
+    """save an ARGB file"""
+    _save(image, filename, (image.pixels,))
+
+
+def save_rows(header, filename, rows):
+    """save an ARGB file a row at a time; header has the width, height,
+    and meta data"""
+    _save(header, filename, rows)
+
+
+def _save(header, filename, blocks):
+    # The pixels may be a memory map of (or rows read from) filename, so
+    # they're written to a temporary file that then replaces it
+    temporary = filename + ".tmp"
+    try:
+        with open(temporary, "wb") as file:
+            _write_header(header, file)
+            for pixels in blocks:
+                _write_pixels(file, pixels)
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _write_header(image, file):
+    meta = json.dumps(image.meta, sort_keys=True).encode("utf-8")
+    file.write(_HEADER.pack(_MAGIC, _VERSION, image.width, image.height,
+            len(meta)))
+    file.write(meta.ljust(_padded(len(meta)), b" "))
+
+
+def _write_pixels(file, pixels):
+    if numpy is not None and isinstance(pixels, numpy.ndarray):
+        file.write(memoryview(pixels.astype("<u4", copy=False)).cast("B"))
+    else:
+        if sys.byteorder == "big":
+            pixels = array.array(Image._typecode(), pixels)
+            pixels.byteswap()
+        file.write(memoryview(pixels).cast("B"))
+
+
+def _padded(size):
+    return (size + 3) & ~3
@@ -21,12 +21,16 @@ Its meta data may optionally include x_hot and y_hot ints to indicate
 the image's hotspot.
 """
 
-import io
+import array
+import itertools
 import mmap
 import os
-import sys
-import warnings
+import re
 import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def can_load(filename):
@@ -47,6 +51,23 @@ _WIDTH = b"width"
 _HEIGHT = b"height"
 _X_HOT = b"x_hot"
 _Y_HOT = b"y_hot"
+_HEX_VALUES = re.compile(rb"(?:0[xX][0-9A-Fa-f]{2})*")
+_INVERT = bytes.maketrans(b"\x00\x01", b"\x01\x00")
+_MAX_PER_LINE = 12
+_BYTES_PER_WRITE = _MAX_PER_LINE * 4096
+# (Image.ColorForName isn't defined yet when this module is imported)
+_BLACK = 0xFF000000
+_WHITE = 0xFFFFFFFF
+_TRANSPARENT = 0x00000000
+
+if numpy is None:
+    # The bytes of the 8 pixels each possible byte of bits expands to
+    _PIXELS_FOR_BYTE = [array.array(Image._typecode(), [_BLACK if
+                        (value >> bit) & 1 else _WHITE for bit in range(8)]
+                        ).tobytes() for value in range(256)]
+# Translations of 1 to each bit's value
+_VALUE_FOR_BIT = [bytes.maketrans(b"\x01", bytes([1 << bit]))
+                  for bit in range(8)]
 
 
 def load(image, filename):
@@ -57,13 +78,23 @@ def load(image, filename):
         j = xbm.find(_BITS)
         if i == -1 or j == -1:
             raise Image.Error("failed to parse '{}'".format(filename))
-        _parse_defines(image, xbm[i:j])
-        image.pixels = Image.create_array(image.width, image.height,
-                Image.ColorForName["white"])
-        _parse_bits(image, xbm[j + len(_BITS):])
+        _parse_defines(image, xbm[i:j], filename)
+        _parse_bits(image, xbm[j + len(_BITS):], filename)
+
+
+def load_header(image, filename):
+    """read an XBM file's width, height, and hotspot (if any) from its
+    #defines"""
+    with open(filename, "rb") as file:
+        xbm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        i = xbm.find(_DEFINE)
+        j = xbm.find(_BITS)
+        if i == -1 or j == -1:
+            raise Image.Error("failed to parse '{}'".format(filename))
+        _parse_defines(image, xbm[i:j], filename)
 
 
-def _parse_defines(image, defines):
+def _parse_defines(image, defines, filename):
     parts = defines.split()
     for define, name, value in zip(parts[0::3], parts[1::3], parts[2::3]):
         if define == _DEFINE:
@@ -76,50 +107,109 @@ def _parse_defines(image, defines):
                     if name.endswith(candidate):
                         image.meta[candidate.decode("ascii")] = int(value)
     if image.width is None or image.height is None:
-        raise Image.Error("missing dimension in '{}'".format(
-            image.filename))
+        raise Image.Error("missing dimension in '{}'".format(filename))
 
 
-def _parse_bits(image, bits):
-    # Algorithm based on the one used by libclaw
+def load_rows(image, filename):
+    """yield an XBM file's rows; the bits (an eighth of a byte per pixel)
+    are read in one go and a row at a time is expanded into pixels"""
+    with open(filename, "rb") as file:
+        xbm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        i = xbm.find(_DEFINE)
+        j = xbm.find(_BITS)
+        if i == -1 or j == -1:
+            raise Image.Error("failed to parse '{}'".format(filename))
+        _parse_defines(image, xbm[i:j], filename)
+        data = _data_for_bits(image, xbm[j + len(_BITS):], filename)
+    rowBytes = (image.width + 7) // 8
+    for offset in range(0, len(data), rowBytes):
+        row = data[offset:offset + rowBytes]
+        if numpy is not None:
+            yield _pixels_for_bytes_numpy(row, image.width, 1)
+        else:
+            yield _pixels_for_bytes(row, image.width)
+
+
+def _parse_bits(image, bits, filename):
+    data = _data_for_bits(image, bits, filename)
+    if numpy is not None:
+        image.pixels = _pixels_for_bytes_numpy(data, image.width,
+                image.height)
+    else:
+        image.pixels = _pixels_for_bytes(data, image.width)
+
+
+def _data_for_bits(image, bits, filename):
+    # Each row starts a new byte and its pixels are the bytes' bits
+    # least significant first; missing bytes are white
     i = bits.find(b"{")
     j = bits.find(b"};", i)
     if i == -1 or j == -1:
-        raise Image.Error("missing bits in '{}'".format(image.filename))
-    black = Image.ColorForName["black"]
-    x = index = 0
-    for value in _values_for_bits(bits[i + 1:j].rstrip()):
-        i = 0
-        while i != 8 and x != image.width:
-            if value & 1:
-                image.pixels[index] = black
-            i += 1
-            index += 1
-            x += 1
-            value >>= 1
-        if x == image.width:
-            x = 0
-
-
-def _values_for_bits(bits):
-    i = 0
-    while i < len(bits):
-        j = bits.find(b",", i)
-        if j == -1:
-            j = len(bits)
-        value = bits[i:j].strip()
-        if value.startswith((b"0x", b"0X")):
-            yield int(value[2:], 16)
-        else:
-            yield int(value)
-        i = j + 1
+        raise Image.Error("missing bits in '{}'".format(filename))
+    data = _bytes_for_values(bits[i + 1:j], filename)
+    count = ((image.width + 7) // 8) * image.height
+    return data[:count].ljust(count, b"\x00")
+
+
+def _bytes_for_values(values, filename):
+    # The usual 0xHH values are converted by slicing out their hex digits
+    tokens = values.replace(b",", b" ").split()
+    joined = b"".join(tokens)
+    if (len(joined) == 4 * len(tokens) and
+            _HEX_VALUES.fullmatch(joined) is not None):
+        digits = bytearray(2 * len(tokens))
+        digits[0::2] = joined[2::4]
+        digits[1::2] = joined[3::4]
+        return bytes.fromhex(digits.decode("ascii"))
+    try:
+        return bytes(_value(token) & 0xFF for token in tokens)
+    except ValueError as err:
+        raise Image.Error("invalid bits in '{}': {}".format(filename, err))
+
+
+def _value(token):
+    if token.startswith((b"0x", b"0X")):
+        return int(token[2:], 16)
+    return int(token)
+
+
+def _pixels_for_bytes_numpy(data, width, height):
+    bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8
+            ).reshape(height, -1), axis=1, bitorder="little")[:, :width]
+    return numpy.where(bits.reshape(-1), numpy.uint32(_BLACK),
+            numpy.uint32(_WHITE)).astype(numpy.uint32, copy=False)
+
+
+def _pixels_for_bytes(data, width):
+    # Each byte expands to 8 pixels' bytes, so rows whose width isn't a
+    # multiple of 8 must be trimmed
+    pixels = array.array(Image._typecode())
+    if width % 8 == 0:
+        pixels.frombytes(b"".join(map(_PIXELS_FOR_BYTE.__getitem__, data)))
+    else:
+        rowBytes = (width + 7) // 8
+        size = width * pixels.itemsize
+        for offset in range(0, len(data), rowBytes):
+            pixels.frombytes(b"".join(map(_PIXELS_FOR_BYTE.__getitem__,
+                    data[offset:offset + rowBytes]))[:size])
+    return pixels
 
 
 def save(image, filename):
     """save an XBM file"""
-    with open(filename, "w+t", encoding="ascii") as file:
+    with open(filename, "wt", encoding="ascii") as file:
         _write_header(image, file, Image.sanitized_name(filename))
-        _write_pixels(image, file)
+        _write_pixels(file, [_bytes_for_pixels(image.pixels, image.width,
+                image.height)])
+
+
+def save_rows(header, filename, rows):
+    """save an XBM file a row at a time; header has the width, height,
+    and meta data"""
+    with open(filename, "wt", encoding="ascii") as file:
+        _write_header(header, file, Image.sanitized_name(filename))
+        _write_pixels(file, (_bytes_for_pixels(row, header.width, 1)
+                             for row in rows))
 
 
 def _write_header(image, file, name):
@@ -133,39 +223,44 @@ def _write_header(image, file, name):
     file.write("static unsigned char {}_bits[] = {{\n  ".format(name))
 
 
-def _write_pixels(image, file):
-    # Algorithm based on the one used by libclaw
-    white = Image.ColorForName["white"]
-    transparent = Image.ColorForName["transparent"]
-    MAX_PER_LINE = 12
-    count = index = 0
-    for y in range(image.height):
-        x = 0
-        while x != image.width:
-            value = bits = 0
-            while x != image.width and bits != 8:
-                value >>= 1
-                if image.pixel(x, y) not in {white, transparent}:
-                    value |= 0x80
-                bits += 1
-                x += 1
-                index += 1
-            value >>= 8 - bits
-            count += 1
-            file.write("0x{:02X}".format(value))
-            if index != len(image.pixels):
-                if count == MAX_PER_LINE:
-                    file.write(",\n  ")
-                    count = 0
-                else:
-                    file.write(", ")
-    # remove spurious trailing comma
-    BACK = 3
-    offset = file.tell() - BACK
-    file.seek(offset, io.SEEK_SET)
-    chunk = file.read(BACK)
-    i = chunk.find(",")
-    if i > -1:
-        file.seek(file.tell() - (BACK - i), io.SEEK_SET)
+def _write_pixels(file, blocks):
+    # The blocks of bytes (of any sizes) are written _BYTES_PER_WRITE at
+    # a time, so the lines are the same however the bytes are split up
+    data = bytearray()
+    first = True
+    for block in itertools.chain(blocks, [None]):
+        if block is not None:
+            data += block
+        while data and (block is None or len(data) >= _BYTES_PER_WRITE):
+            if not first:
+                file.write(",\n  ")
+            first = False
+            chunk = data[:_BYTES_PER_WRITE]
+            del data[:_BYTES_PER_WRITE]
+            file.write(",\n  ".join(", ".join(map("0x{:02X}".format,
+                    chunk[i:i + _MAX_PER_LINE]))
+                    for i in range(0, len(chunk), _MAX_PER_LINE)))
     file.write("};\n")
-    file.truncate()
+
+
+def _bytes_for_pixels(pixels, width, height):
+    # Returns the bits, each row starting a new byte, least significant
+    # bit first; pixels that aren't white or transparent are set
+    if numpy is not None and isinstance(pixels, numpy.ndarray):
+        bits = ((pixels != _WHITE) & (pixels != _TRANSPARENT))
+        return numpy.packbits(bits.reshape(height, width), axis=1,
+                bitorder="little").tobytes()
+    flags = bytes(map({_WHITE, _TRANSPARENT}.__contains__,
+            pixels)).translate(_INVERT)
+    padding = -width % 8
+    if padding:
+        pad = bytes(padding)
+        flags = b"".join(flags[offset:offset + width] + pad
+                for offset in range(0, len(flags), width))
+    # Each bit's flags are translated to that bit's value; since these
+    # don't overlap the bytes can be ORed together as big ints
+    value = 0
+    for bit in range(8):
+        value |= int.from_bytes(flags[bit::8].translate(_VALUE_FOR_BIT[bit]),
+                "big")
+    return value.to_bytes(len(flags) // 8, "big")
@@ -27,18 +27,23 @@ Its meta data may optionally include x_hot and y_hot ints to indicate
 the image's hotspot.
 """
 
-import io
+import array
 import itertools
 import os
 import warnings
 import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 _XPM = "/* XPM */"
-(_WANT_XPM, _WANT_NAME, _WANT_VALUES, _WANT_COLOR, _WANT_PIXELS,
- _DONE) = ("WANT_XPM", "WANT_NAME", "WANT_VALUES", "WANT_COLOR",
-        "WANT_PIXELS", "DONE")
+(_WANT_XPM, _WANT_NAME, _WANT_VALUES, _WANT_COLOR,
+ _WANT_PIXELS) = ("WANT_XPM", "WANT_NAME", "WANT_VALUES", "WANT_COLOR",
+        "WANT_PIXELS")
 _CODES = "".join((chr(x) for x in range(32, 127) if chr(x) not in '\\"'))
+_CHUNK_SIZE = 1 << 20 # Approximate number of characters per write
 
 
 def can_load(filename):
@@ -55,36 +60,71 @@ def can_save(filename):
 
 def load(image, filename):
     """load an XPM file"""
-    colors = cpp = count = None
+    with open(filename, "rt", encoding="ascii") as file:
+        lines = enumerate(file, start=1)
+        palette, cpp = _parse_preamble(lines, image, filename)
+        image.pixels = Image.create_array(image.width, image.height)
+        _parse_pixels(lines, image, palette, cpp)
+
+
+def load_rows(image, filename):
+    """yield an XPM file's rows; they're decoded in blocks of up to
+    about a megabyte of codes"""
+    with open(filename, "rt", encoding="ascii") as file:
+        lines = enumerate(file, start=1)
+        palette, cpp = _parse_preamble(lines, image, filename)
+        rowsPerBlock = max(1, _CHUNK_SIZE // (image.width * cpp))
+        for start in range(0, image.height, rowsPerBlock):
+            rows = min(rowsPerBlock, image.height - start)
+            pixels = Image.create_array(image.width, rows)
+            _parse_pixels(lines, image, palette, cpp, pixels, rows)
+            for offset in range(0, len(pixels), image.width):
+                yield pixels[offset:offset + image.width]
+
+
+def _parse_preamble(lines, image, filename):
+    # Reads the lines up to the pixels and returns the palette and the
+    # characters per pixel
+    cpp = count = None
     state = _WANT_XPM
     palette = {}
-    index = 0
+    for lino, line in lines:
+        line = line.strip()
+        if not line or (line.startswith(("/*", "//")) and state !=
+                _WANT_XPM):
+            continue
+        # if branches are ordered by frequency of occurrence
+        if state == _WANT_COLOR:
+            count, state = _parse_color(lino, line, palette, cpp, count)
+            if state == _WANT_PIXELS:
+                return palette, cpp
+        elif state == _WANT_XPM:
+            state = _parse_xpm(lino, line)
+        elif state == _WANT_NAME:
+            state = _parse_name(lino, line)
+        elif state == _WANT_VALUES:
+            _, cpp, count, state = _parse_values(lino, line, image)
+    raise Image.Error("failed to parse '{}'".format(filename))
+
+
+def load_header(image, filename):
+    """read an XPM file's width, height, and hotspot (if any), i.e.,
+    only as far as its values line"""
+    state = _WANT_XPM
     with open(filename, "rt", encoding="ascii") as file:
         for lino, line in enumerate(file, start=1):
             line = line.strip()
             if not line or (line.startswith(("/*", "//")) and state !=
                     _WANT_XPM):
                 continue
-            # if branches are ordered by frequency of occurrence
-            if state == _WANT_COLOR:
-                count, state = _parse_color(lino, line, palette, cpp,
-                        count)
-                if state == _WANT_PIXELS:
-                    count = image.height
-            elif state == _WANT_PIXELS:
-                count, state, index = _parse_pixels(lino, line,
-                        image.pixels, palette, cpp, count, index)
-                if state == _DONE:
-                    break
-            elif state == _WANT_XPM:
+            if state == _WANT_XPM:
                 state = _parse_xpm(lino, line)
             elif state == _WANT_NAME:
                 state = _parse_name(lino, line)
-            elif state == _WANT_VALUES:
-                colors, cpp, count, state = _parse_values(lino, line,
-                        image)
-                image.pixels = Image.create_array(image.width,
-                        image.height)
+            else:
+                _parse_values(lino, line, image)
+                return
+    raise Image.Error("failed to parse '{}'".format(filename))
 
 
 def _parse_xpm(lino, line):
@@ -137,16 +177,82 @@ def _parse_color(lino, line, palette, cpp, count):
     return count, _WANT_COLOR
 
 
-def _parse_pixels(lino, line, pixels, palette, cpp, count, index):
-    line = _sanitize_quoted_line(lino, line)
-    for i in range(0, len(line), cpp):
-        color = palette[line[i:i + cpp]]
-        pixels[index] = color
-        index += 1
-    count -= 1
-    if count == 0:
-        return count, _DONE, index
-    return count, _WANT_PIXELS, index
+def _parse_pixels(lines, image, palette, cpp, pixels=None, height=None):
+    # The rows (all of them unless pixels and height are given for a
+    # block of them) are read in one go and their codes are translated
+    # into colors in bulk rather than pixel by pixel
+    if pixels is None:
+        pixels = image.pixels
+        height = image.height
+    rows = []
+    for lino, line in lines:
+        line = line.strip()
+        if not line or line.startswith(("/*", "//")):
+            continue
+        rows.append(_sanitize_quoted_line(lino, line))
+        if len(rows) == height:
+            break
+    codes = "".join(rows)
+    if len(rows) != height or len(codes) != image.width * height * cpp:
+        raise Image.Error("invalid XPM file: expected {} rows of {} "
+                "pixels".format(image.height, image.width))
+    try:
+        if numpy is not None and isinstance(pixels, numpy.ndarray):
+            _colors_for_codes_numpy(codes, pixels, palette, cpp)
+        else:
+            keys = codes
+            if cpp > 1:
+                keys = (codes[i:i + cpp] for i in range(0, len(codes),
+                        cpp))
+            pixels[:] = array.array(pixels.typecode,
+                    map(palette.__getitem__, keys))
+    except KeyError as err:
+        raise Image.Error("invalid XPM file: unknown color code {}"
+                .format(err))
+
+
+def _colors_for_codes_numpy(codes, pixels, palette, cpp):
+    codes = numpy.frombuffer(codes.encode("ascii"), dtype=numpy.uint8)
+    if cpp == 1:
+        lookup = numpy.zeros(256, dtype=numpy.uint32)
+        known = numpy.zeros(256, dtype=bool)
+        for code, color in palette.items():
+            lookup[ord(code)] = color
+            known[ord(code)] = True
+        if not known[codes].all():
+            raise KeyError(chr(codes[~known[codes]][0]))
+        pixels[:] = lookup[codes]
+        return
+    # Each code's characters are packed into one unsigned int key that
+    # is looked up in the sorted palette keys
+    keys = _keys_for_codes(codes.reshape(-1, cpp))
+    paletteKeys = _keys_for_codes(numpy.frombuffer("".join(
+            palette.keys()).encode("ascii"), dtype=numpy.uint8).reshape(
+            -1, cpp))
+    colors = numpy.fromiter(palette.values(), dtype=numpy.uint32,
+            count=len(palette))
+    order = numpy.argsort(paletteKeys)
+    paletteKeys = paletteKeys[order]
+    colors = colors[order]
+    positions = numpy.searchsorted(paletteKeys, keys)
+    numpy.minimum(positions, len(paletteKeys) - 1, out=positions)
+    unknown = paletteKeys[positions] != keys
+    if unknown.any():
+        i = int(numpy.argmax(unknown))
+        raise KeyError(codes[i * cpp:(i + 1) * cpp].tobytes().decode(
+                "ascii"))
+    pixels[:] = colors[positions]
+
+
+def _keys_for_codes(codes):
+    if codes.shape[1] > 8:
+        raise Image.Error("XPM files with more than 8 characters per "
+                "pixel are not supported")
+    keys = numpy.zeros(codes.shape[0], dtype=numpy.uint64)
+    for column in range(codes.shape[1]):
+        keys <<= numpy.uint64(8)
+        keys |= codes[:, column]
+    return keys
 
 
 def _sanitize_quoted_line(lino, line):
@@ -160,35 +266,35 @@ def save(image, filename):
     """save an XPM file"""
     name = Image.sanitized_name(filename)
     palette, cpp = _palette_and_cpp(image.pixels)
-    with open(filename, "w+t", encoding="ascii") as file:
+    with open(filename, "wt", encoding="ascii") as file:
         _write_header(image, file, name, cpp, len(palette))
         _write_palette(file, palette)
-        _write_pixels(image, file, palette)
+        _write_pixels(image, file, palette, cpp)
 
 
 def _palette_and_cpp(pixels):
-    colors = set()
-    transparent = Image.ColorForName["transparent"]
-    for color in pixels:
-        if color == transparent:
-            name = "None" # special-case transparent
-        else: # strip off alpha
-            name = "#{:06X}".format(color & Image.CLEAR_ALPHA)
-        colors.add((color, name))
+    # The distinct colors are found in bulk and only they are named;
+    # they're sorted so that we get the same order every time (this
+    # doesn't matter for the format but helps with regressions testing)
+    if numpy is not None and isinstance(pixels, numpy.ndarray):
+        # Done in chunks so a memory-mapped image needn't all be in memory
+        colors = numpy.unique(numpy.concatenate([numpy.unique(
+                pixels[start:start + _CHUNK_SIZE]) for start in range(0,
+                max(1, len(pixels)), _CHUNK_SIZE)])).tolist()
+    else:
+        colors = sorted(set(pixels))
     cpp = 1
     while True:
         if len(colors) <= len(_CODES) ** cpp:
             break
         cpp += 1
-    # we turn the colors into a list so that we get the same order every
-    # time (this doesn't matter for the format but helps with
-    # regressions testing)
-    colors = sorted(colors, reverse=True)
+    transparent = Image.ColorForName["transparent"]
     palette = {}
-    for code in itertools.product(_CODES, repeat=cpp):
-        if not colors:
-            break
-        color, name = colors.pop()
+    for color, code in zip(colors, itertools.product(_CODES, repeat=cpp)):
+        if color == transparent:
+            name = "None" # special-case transparent
+        else: # strip off alpha
+            name = "#{:06X}".format(color & Image.CLEAR_ALPHA)
         palette[color] = ("".join(code), name)
     return palette, cpp
 
@@ -210,12 +316,47 @@ def _write_palette(file, palette):
         file.write('"{}\tc {}",\n'.format(code, name)) # \t is nicer in vim
 
 
-def _write_pixels(image, file, palette):
-    for y in range(image.height):
-        file.write('"')
-        for x in range(image.width):
-            code = palette[image.pixel(x, y)][0]
-            file.write(code)
-        file.write('",\n')
-    file.seek(file.tell() - 2, io.SEEK_SET) # Get rid of spurious ,\n
+def _write_pixels(image, file, palette, cpp):
+    # Each row is built in one go and the rows are written in large
+    # chunks, so the number of writes depends on the height not the area
+    rowsPerWrite = max(1, _CHUNK_SIZE // ((image.width * cpp) + 4))
+    if numpy is not None and isinstance(image.pixels, numpy.ndarray):
+        chunks = _pixel_chunks_numpy(image, palette, cpp, rowsPerWrite)
+    else:
+        chunks = _pixel_chunks(image, palette, rowsPerWrite)
+    for chunk in chunks:
+        file.write(chunk)
     file.write("};\n")
+
+
+def _pixel_chunks(image, palette, rowsPerWrite):
+    codeForColor = {color: code for color, (code, _) in palette.items()}
+    for start in range(0, image.height, rowsPerWrite):
+        end = min(image.height, start + rowsPerWrite)
+        rows = []
+        for y in range(start, end):
+            row = image.pixels[y * image.width:(y + 1) * image.width]
+            rows.append('"' + "".join(map(codeForColor.__getitem__, row)) +
+                    '"')
+        yield ",\n".join(rows) + (",\n" if end < image.height else "")
+
+
+def _pixel_chunks_numpy(image, palette, cpp, rowsPerWrite):
+    # palette's keys are in ascending order so searchsorted() gives each
+    # pixel's palette index
+    colors = numpy.fromiter(palette.keys(), dtype=numpy.uint32,
+            count=len(palette))
+    codes = numpy.frombuffer("".join(code for code, _ in
+            palette.values()).encode("ascii"), dtype=numpy.uint8).reshape(
+            -1, cpp)
+    pixels = image.pixels.reshape(image.height, image.width)
+    for start in range(0, image.height, rowsPerWrite):
+        end = min(image.height, start + rowsPerWrite)
+        lines = numpy.empty((end - start, (image.width * cpp) + 4),
+                dtype=numpy.uint8)
+        lines[:, 0] = ord('"')
+        lines[:, 1:-3] = codes[numpy.searchsorted(colors,
+                pixels[start:end])].reshape(end - start, -1)
+        lines[:, -3:] = numpy.frombuffer(b'",\n', dtype=numpy.uint8)
+        chunk = lines.tobytes().decode("ascii")
+        yield chunk if end < image.height else chunk[:-2]
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+The color quantizer used by Image.quantize(). (Image doesn't load
+modules whose names begin with an underscore as plugins.)
+
+The palette is chosen by median cut: starting with a box holding all the
+image's distinct colors, the box with the widest range in any of red,
+green, or blue is split at its pixel-weighted median along that channel
+until there are enough boxes; each box's color is the pixel-weighted
+mean of its colors.
+
+Without dithering each pixel gets the color of the box its color is in.
+With Floyd–Steinberg dithering each pixel gets the palette color nearest
+to it plus the error diffused from its neighbors, looked up in a cube of
+32 x 32 x 32 cells. With numpy the pixels along each anti-diagonal x + 2y
+are independent of each other (their neighbors to the left and above
+have all been done) so each is done as a whole array.
+
+The numpy and pure Python versions give identical results.
+"""
+
+import array
+import collections
+import heapq
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAX_COMPONENT = 0xFF
+SOLID = 0xFF000000
+SHIFTS = (16, 8, 0) # r, g, b
+CELL_BITS = 3 # Components are looked up in cells of 1 << CELL_BITS
+
+
+def quantize(pixels, width, height, colors, dither=False):
+    """returns a copy of the pixels with at most colors distinct solid
+    colors, plus transparent for any pixels whose alpha is 0
+
+    The copy is a numpy.array if pixels is, and an array.array
+    otherwise."""
+    assert colors >= 1
+    if numpy is not None and isinstance(pixels, numpy.ndarray):
+        return _quantize_numpy(pixels, width, height, colors, dither)
+    return _quantize(pixels, width, height, colors, dither)
+
+
+def _quantize_numpy(pixels, width, height, colors, dither):
+    opaque = (pixels >> 24) != 0
+    rgbs, inverse, counts = numpy.unique(pixels[opaque] & 0xFFFFFF,
+            return_inverse=True, return_counts=True)
+    components = numpy.stack([(rgbs >> shift) & MAX_COMPONENT
+                              for shift in SHIFTS], axis=1).astype(
+                              numpy.int64)
+    palette, labels = _median_cut_numpy(components, counts, colors)
+    if dither:
+        indexes = _dither_numpy(pixels, width, height, palette)[opaque]
+    else:
+        indexes = labels[inverse.reshape(-1)]
+    solids = numpy.uint32(SOLID) | ((palette[:, 0] << 16) | (palette[:, 1]
+            << 8) | palette[:, 2]).astype(numpy.uint32)
+    newPixels = numpy.zeros_like(pixels, dtype=numpy.uint32)
+    newPixels[opaque] = solids[indexes]
+    return newPixels
+
+
+def _dither_numpy(pixels, width, height, palette):
+    # Returns the palette index of every pixel; work holds each pixel's
+    # components plus the errors diffused to it so far, with a column of
+    # padding at each side
+    cells = _nearest_cells_numpy(palette)
+    work = numpy.zeros((height + 1, width + 2, 3), dtype=numpy.float64)
+    for channel, shift in enumerate(SHIFTS):
+        work[:height, 1:-1, channel] = ((pixels.reshape(height, width) >>
+                shift) & MAX_COMPONENT)
+    indexes = numpy.empty((height, width), dtype=numpy.intp)
+    for diagonal in range(width + (2 * (height - 1))):
+        ys = numpy.arange(max(0, -((width - 1 - diagonal) // 2)),
+                min(height - 1, diagonal // 2) + 1)
+        xs = diagonal - (2 * ys) + 1 # + 1 for the padding
+        values = numpy.clip(work[ys, xs], 0, MAX_COMPONENT)
+        cell = values.astype(numpy.int64) >> CELL_BITS
+        index = cells[(cell[:, 0] << 10) | (cell[:, 1] << 5) | cell[:, 2]]
+        indexes[ys, xs - 1] = index
+        error = values - palette[index]
+        # The order matches the pure Python version's, so the sums do
+        work[ys + 1, xs - 1] += error * 3 / 16
+        work[ys + 1, xs] += error * 5 / 16
+        work[ys + 1, xs + 1] += error / 16
+        work[ys, xs + 1] += error * 7 / 16
+    return indexes.reshape(-1)
+
+
+def _median_cut_numpy(components, counts, colors):
+    # Like _median_cut() but components is an (n x 3) numpy.array and
+    # counts an (n) numpy.array; the palette and labels are numpy.arrays
+    labels = numpy.zeros(len(components), dtype=numpy.intp)
+    if not len(components):
+        return numpy.zeros((1, 3), dtype=numpy.int64), labels
+    boxes = []
+    order = 0
+    heapq.heappush(boxes, _box_numpy(components, numpy.arange(
+            len(components)), order))
+    while len(boxes) < colors and -boxes[0][0] > 0:
+        _, _, channel, indexes = heapq.heappop(boxes)
+        indexes = indexes[numpy.argsort(components[indexes, channel],
+                kind="stable")]
+        totals = numpy.cumsum(counts[indexes])
+        split = min(len(indexes) - 1, int(numpy.searchsorted(totals,
+                totals[-1] / 2)) + 1)
+        for part in (indexes[:split], indexes[split:]):
+            order += 1
+            heapq.heappush(boxes, _box_numpy(components, part, order))
+    palette = numpy.empty((len(boxes), 3), dtype=numpy.int64)
+    for label, (_, _, _, indexes) in enumerate(sorted(boxes,
+            key=lambda box: box[1])):
+        weights = counts[indexes]
+        palette[label] = numpy.rint((components[indexes] *
+                weights[:, None]).sum(axis=0) / weights.sum())
+        labels[indexes] = label
+    return palette, labels
+
+
+def _box_numpy(components, indexes, order):
+    box = components[indexes]
+    ranges = box.max(axis=0) - box.min(axis=0)
+    channel = int(numpy.argmax(ranges))
+    return (-int(ranges[channel]), order, channel, indexes)
+
+
+def _nearest_cells_numpy(palette):
+    # Returns the index of the palette color nearest to each cell's
+    # center, for cells indexed by (r << 10) | (g << 5) | b
+    count = (MAX_COMPONENT + 1) >> CELL_BITS
+    centers = (numpy.arange(count) << CELL_BITS) + (1 << (CELL_BITS - 1))
+    r, g, b = numpy.meshgrid(centers, centers, centers, indexing="ij")
+    cells = numpy.stack((r.ravel(), g.ravel(), b.ravel()), axis=1)
+    nearest = numpy.empty(len(cells), dtype=numpy.intp)
+    step = max(1, (1 << 20) // len(palette))
+    for start in range(0, len(cells), step):
+        differences = (cells[start:start + step, None, :] -
+                       palette[None, :, :])
+        nearest[start:start + step] = numpy.argmin((differences *
+                differences).sum(axis=2), axis=1)
+    return nearest
+
+
+def _quantize(pixels, width, height, colors, dither):
+    counter = collections.Counter(pixels)
+    counts = collections.Counter()
+    for color, count in counter.items():
+        if color >> 24:
+            counts[color & 0xFFFFFF] += count
+    rgbs = sorted(counts)
+    components = [[(rgb >> shift) & MAX_COMPONENT for shift in SHIFTS]
+                  for rgb in rgbs]
+    palette, labels = _median_cut(components, [counts[rgb] for rgb in
+            rgbs], colors)
+    solids = [SOLID | (r << 16) | (g << 8) | b for r, g, b in palette]
+    if dither:
+        return _dither(pixels, width, height, palette, solids)
+    solidForRgb = {rgb: solids[label] for rgb, label in zip(rgbs, labels)}
+    newColor = {color: solidForRgb[color & 0xFFFFFF] if color >> 24 else 0
+                for color in counter}
+    return array.array(_typecode(), map(newColor.__getitem__, pixels))
+
+
+def _dither(pixels, width, height, palette, solids):
+    cells = {}
+    below = [0.0] * ((width + 2) * 3)
+    below[3:-3] = _components(pixels[:width])
+    newPixels = array.array(_typecode(), bytes(width * height *
+            array.array(_typecode()).itemsize))
+    for y in range(height):
+        row = below
+        below = [0.0] * ((width + 2) * 3)
+        if y + 1 < height:
+            below[3:-3] = _components(pixels[(y + 1) * width:(y + 2) *
+                    width])
+        offset = y * width
+        for x in range(width):
+            i = (x + 1) * 3 # + 1 for the padding
+            r = min(max(row[i], 0), MAX_COMPONENT)
+            g = min(max(row[i + 1], 0), MAX_COMPONENT)
+            b = min(max(row[i + 2], 0), MAX_COMPONENT)
+            cell = ((int(r) >> CELL_BITS) << 10 | (int(g) >> CELL_BITS) << 5
+                    | (int(b) >> CELL_BITS))
+            index = cells.get(cell)
+            if index is None:
+                index = cells[cell] = _nearest(cell, palette)
+            if pixels[offset + x] >> 24:
+                newPixels[offset + x] = solids[index]
+            pr, pg, pb = palette[index]
+            for j, error in ((i, r - pr), (i + 1, g - pg), (i + 2, b - pb)):
+                below[j - 3] += error * 3 / 16
+                below[j] += error * 5 / 16
+                below[j + 3] += error / 16
+                row[j + 3] += error * 7 / 16
+    return newPixels
+
+
+def _components(pixels):
+    components = []
+    for color in pixels:
+        components += [float((color >> shift) & MAX_COMPONENT)
+                       for shift in SHIFTS]
+    return components
+
+
+def _nearest(cell, palette):
+    half = 1 << (CELL_BITS - 1)
+    r = ((cell >> 10) << CELL_BITS) + half
+    g = (((cell >> 5) & 0x1F) << CELL_BITS) + half
+    b = ((cell & 0x1F) << CELL_BITS) + half
+    return min(range(len(palette)), key=lambda i: ((r - palette[i][0]) ** 2
+               + (g - palette[i][1]) ** 2 + (b - palette[i][2]) ** 2))
+
+
+def _median_cut(components, counts, colors):
+    # components is a list of distinct [r, g, b]s and counts how many
+    # pixels have each; returns the palette as a list of [r, g, b]s and
+    # the index of the palette color for each of components
+    palette = []
+    labels = [0] * len(components)
+    if not components:
+        return [[0, 0, 0]], labels
+    boxes = [] # heap of (-range, order, channel, indexes)
+    order = 0
+    heapq.heappush(boxes, _box(components, list(range(len(components))),
+            order))
+    while len(boxes) < colors and -boxes[0][0] > 0:
+        _, _, channel, indexes = heapq.heappop(boxes)
+        indexes.sort(key=lambda i: components[i][channel])
+        half = sum(counts[i] for i in indexes) / 2
+        total = 0
+        for split, i in enumerate(indexes[:-1], start=1):
+            total += counts[i]
+            if total >= half:
+                break
+        for part in (indexes[:split], indexes[split:]):
+            order += 1
+            heapq.heappush(boxes, _box(components, part, order))
+    for _, _, _, indexes in sorted(boxes, key=lambda box: box[1]):
+        total = sum(counts[i] for i in indexes)
+        palette.append([round(sum(components[i][channel] * counts[i]
+                        for i in indexes) / total) for channel in range(3)])
+        for i in indexes:
+            labels[i] = len(palette) - 1
+    return palette, labels
+
+
+def _box(components, indexes, order):
+    ranges = [max(components[i][channel] for i in indexes) -
+              min(components[i][channel] for i in indexes)
+              for channel in range(3)]
+    widest = max(ranges)
+    return (-widest, order, ranges.index(widest), indexes)
+
+
+def _typecode():
+    # Use the smallest typecode that can store a 32-bit unsigned integer
+    return "I" if array.array("I").itemsize >= 4 else "L"
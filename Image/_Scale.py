@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+The whole-array scaling engine used by Image.scale() when the image's
+pixels are held in a numpy.array(). (Image doesn't load modules whose
+names begin with an underscore as plugins.)
+
+The results are identical to those produced by Image.scale()'s pure
+Python loop: the boxes are computed with the same rounding (numpy.rint()
+and round() both round halves to even), and each box's mean is the
+float quotient of two exact integer sums, rounded the same way.
+"""
+
+import numpy
+
+
+MAX_COMPONENT = 0xFF
+SHIFTS = (24, 16, 8, 0) # α, r, g, b
+BAND_PIXELS = 1 << 22 # Source pixels to process at a time
+
+
+def bounds(length, count):
+    """returns two numpy.arrays of the first and one past the last index
+    of each of the count boxes that length is divided into"""
+    step = length / count
+    starts = numpy.rint(numpy.arange(count) * step).astype(numpy.int64)
+    ends = numpy.rint(starts + step).astype(numpy.int64)
+    numpy.minimum(ends, length, out=ends)
+    return starts, ends
+
+
+def scale(pixels, width, height, newPixels, columns, rows, start=0,
+        end=None):
+    """fills newPixels with a box-filtered copy of pixels that has the
+    given number of columns and rows; if start and end are given only
+    rows start to end - 1 are filled
+
+    The work is done in bands of output rows so that the temporary
+    arrays stay small however big the image is."""
+    if end is None:
+        end = rows
+    x0, x1 = bounds(width, columns)
+    y0, y1 = bounds(height, rows)
+    bandRows = max(1, int(BAND_PIXELS / (width * (height / rows))))
+    for first in range(start, end, bandRows):
+        last = min(end, first + bandRows)
+        newPixels[first * columns:last * columns] = scale_band(pixels,
+                width, x0, x1, y0[first:last], y1[first:last]).ravel()
+
+
+def scale_band(pixels, width, x0, x1, y0, y1):
+    """returns a 2D numpy.array of the box means for the given box
+    boundaries; the y0 and y1 arrays cover only this band's rows"""
+    top = int(y0.min())
+    bottom = int(y1.max())
+    source = pixels[top * width:bottom * width].reshape(-1, width)
+    counts = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    y0 = y0 - top
+    y1 = y1 - top
+    result = numpy.zeros(counts.shape, dtype=numpy.uint32)
+    rowSums = numpy.zeros((source.shape[0], width + 1), dtype=numpy.int64)
+    boxSums = numpy.zeros((source.shape[0] + 1, len(x0)),
+            dtype=numpy.int64)
+    for shift in SHIFTS:
+        channel = (source >> shift) & MAX_COMPONENT
+        numpy.cumsum(channel, axis=1, out=rowSums[:, 1:])
+        numpy.cumsum(rowSums[:, x1] - rowSums[:, x0], axis=0,
+                out=boxSums[1:])
+        totals = boxSums[y1] - boxSums[y0]
+        means = numpy.rint(totals / counts).astype(numpy.uint32)
+        result |= means << numpy.uint32(shift)
+    return result
+
+
+def summed_areas(pixels, width, height):
+    """returns a (4, height + 1, width + 1) numpy.array holding the α,
+    r, g, b summed-area tables for pixels"""
+    source = pixels.reshape(height, width)
+    sums = numpy.zeros((len(SHIFTS), height + 1, width + 1),
+            dtype=numpy.int64)
+    for table, shift in zip(sums, SHIFTS):
+        channel = (source >> shift) & MAX_COMPONENT
+        numpy.cumsum(channel, axis=1, out=table[1:, 1:])
+        numpy.cumsum(table[1:, 1:], axis=0, out=table[1:, 1:])
+    return sums
+
+
+def scale_from_sums(sums, width, height, newPixels, columns, rows,
+        start=0, end=None):
+    """like scale() but computes each box's total in O(1) from the
+    summed-area tables returned by summed_areas()"""
+    if end is None:
+        end = rows
+    x0, x1 = bounds(width, columns)
+    y0, y1 = bounds(height, rows)
+    y0 = y0[start:end]
+    y1 = y1[start:end]
+    counts = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    result = numpy.zeros(counts.shape, dtype=numpy.uint32)
+    for table, shift in zip(sums, SHIFTS):
+        totals = (table[numpy.ix_(y1, x1)] - table[numpy.ix_(y0, x1)] -
+                  table[numpy.ix_(y1, x0)] + table[numpy.ix_(y0, x0)])
+        means = numpy.rint(totals / counts).astype(numpy.uint32)
+        result |= means << numpy.uint32(shift)
+    newPixels[start * columns:end * columns] = result.ravel()
@@ -23,41 +23,93 @@ image formats (see Xbm.py and Xpm.py).
 Every module *must* provide can_save(filename) and can_load(filename)
 functions: these should return a value between 0 (can't) and 100 (can to
 perfection); and, of course, load(image, filename), and save(image,
-filename) functions. If you want to override an existing module (e.g.,
-Xbm.py, just create a new one, say, Xbm2.py, and make sure its
-can_load() and can_save() functions return higher values than the Xpm.py
-module. (All standard modules return 100 or less for what they can and 0
-for what they can't.)
+filename) functions. Modules may also provide a load_header(image,
+filename) function that sets only the width, height, and meta data,
+reading as little of the file as possible. If you want to override an
+existing module (e.g., Xbm.py, just create a new one, say, Xbm2.py, and
+make sure its can_load() and can_save() functions return higher values
+than the Xpm.py module. (All standard modules return 100 or less for
+what they can and 0 for what they can't.)
 
 Rather than creating Images directly, use one of the construction
-functions, create(), from_file(), or from_data().
+functions, create(), from_file(), from_data(), or from_backing().
+Use open_header() to get an image's size and meta data without decoding
+its pixels (they're decoded if and when they're first used).
+
+Images can also be streamed a row at a time: iter_rows() yields a file's
+rows, scale_rows() scales rows as they come, and write_rows() saves
+them, so an image can be converted or scaled with only a few of its rows
+in memory. Modules may provide load_rows(image, filename), which sets
+the image's width, height, and meta data and returns an iterator of
+rows, and save_rows(header, filename, rows), where header has the width,
+height, and meta data; modules without them are handled by loading the
+whole image, or by saving a memory-mapped copy of the rows.
+
+Images too big for memory can be backed by a file of native-endian
+32-bit ARGB words that is memory-mapped (see create(), from_backing(),
+scale(), and subsample()); only the parts of the image that are being
+worked on need to be in memory.
+
+Scaling, subsampling, and filling are each done by the fastest
+available backend that can handle the image's pixels: Cython (if cyImage
+has been built), numpy, or pure Python. Use backends() to see which are
+available, last_backend() to see which served a call, and
+prefer_backends() or the IMAGE_BACKENDS environment variable (e.g.,
+IMAGE_BACKENDS=python or IMAGE_BACKENDS=scale=numpy) to choose others.
+Further backends can be added with register_backend().
 
 For sophisticated image processing install numpy _and_ scipy and use
 the scipy image processing functions.
 """
 
+import array
 import collections
+import concurrent.futures
 import importlib
+import itertools
+import math
+import mmap
+import operator
 import os
 import re
 import sys
+import tempfile
+import threading
 import warnings
 try:
     import numpy
 except ImportError:
     numpy = None
-    import array
+    _cyScale = None
+else:
+    import Image._Scale as _Scale
+    try:
+        import cyImage.cyImage._Scale as _cyScale
+    except ImportError:
+        _cyScale = None
+try:
+    from multiprocessing import shared_memory
+except ImportError: # Python < 3.8
+    shared_memory = None
+import Image._Quantize as _Quantize
 
 
 CLEAR_ALPHA = 0x00FFFFFF # & to ARGB color int to get rid of alpha channel
 MAX_ARGB = 0xFFFFFFFF
 MAX_COMPONENT = 0xFF
 SOLID = 0xFF000000 # + to RGB color int to get a solid ARGB color int
+_MAP_CHUNK_PIXELS = 1 << 20 # Pixels to fill at a time in mapped arrays
 
 
 class Error(Exception): pass
 
 
+def _typecode():
+    # Use the smallest typecode that can store a 32-bit unsigned integer
+    # (defined before the modules are loaded since they use it)
+    return "I" if array.array("I").itemsize >= 4 else "L"
+
+
 _Modules = []
 for name in os.listdir(os.path.dirname(__file__)):
     if not name.startswith("_") and name.endswith(".py"):
@@ -73,16 +125,22 @@ del name, module
 class Image:
 
     def __init__(self, width=None, height=None, filename=None,
-            background=None, pixels=None):
+            background=None, pixels=None, backing=None, lazy=False):
         """Create Images using one of the convenience construction
-        functions: from_file(), create(), and from_data()
+        functions: from_file(), open_header(), create(), from_data(),
+        and from_backing()
         
         Although .width and .height are public they should not be
         changed except in load() methods."""
         assert (width is not None and (height is not None or
                 pixels is not None) or (filename is not None))
+        self._cacheSums = False
+        self._sums = None
         if filename is not None: # From file
-            self.load(filename)
+            if lazy:
+                self.load_header(filename)
+            else:
+                self.load(filename)
         elif pixels is not None: # From data
             self.width = width
             self.height = len(pixels) // width
@@ -94,7 +152,8 @@ class Image:
             self.height = height
             self.filename = filename
             self.meta = {}
-            self.pixels = create_array(width, height, background)
+            self.pixels = create_array(width, height, background,
+                    backing)
 
 
     @classmethod
@@ -103,8 +162,21 @@ class Image:
 
 
     @classmethod
-    def create(Class, width, height, background=None):
-        return Class(width=width, height=height, background=background)
+    def open_header(Class, filename):
+        """returns an image with its width, height, and meta data read
+        from the file but whose pixels are only decoded when they're
+        first accessed (or straight away if the file's module can't read
+        just the header)"""
+        return Class(filename=filename, lazy=True)
+
+
+    @classmethod
+    def create(Class, width, height, background=None, backing=None):
+        """if backing is given it is the name of a file that is created
+        (or overwritten) to hold the pixels and which is memory-mapped
+        """
+        return Class(width=width, height=height, background=background,
+                backing=backing)
 
 
     @classmethod
@@ -112,6 +184,15 @@ class Image:
         return Class(width=width, pixels=pixels)
 
 
+    @classmethod
+    def from_backing(Class, width, backing):
+        """returns an image whose pixels are memory-mapped from the
+        existing backing file, e.g., one created by create(),
+        subsample(), or scale(); changes to the pixels change the file
+        """
+        return Class(width=width, pixels=map_array(backing))
+
+
     def load(self, filename):
         """loads the image from the file called filename; the format is
         determined by the file suffix"""
@@ -119,23 +200,58 @@ class Image:
         if module is not None:
             self.width = self.height = None
             self.meta = {}
+            self._sums = None
             module.load(self, filename)
             self.filename = filename
+            _record("load", _codec_name(module))
         else:
             raise Error("no Image module can load files of type {}".format(
                     os.path.splitext(filename)[1]))
 
 
-    def save(self, filename=None):
+    def load_header(self, filename):
+        """reads the image's width, height, and meta data from the file
+        called filename, leaving the pixels to be loaded on first access
+        """
+        module = Image._choose_module("can_load", filename)
+        if getattr(module, "load_header", None) is None:
+            self.load(filename)
+            return
+        self.width = self.height = None
+        self.meta = {}
+        self._sums = None
+        self.__dict__.pop("pixels", None)
+        module.load_header(self, filename)
+        self.filename = filename
+
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, so only costs anything for
+        # the pixels of an image from open_header() that aren't loaded
+        if name == "pixels" and self.__dict__.get("filename"):
+            self.load(self.filename)
+            if "pixels" in self.__dict__:
+                return self.__dict__["pixels"]
+        raise AttributeError("'{}' object has no attribute '{}'".format(
+                type(self).__name__, name))
+
+
+    def save(self, filename=None, colors=None, dither=False):
         """saves the image to a file called filename; the format is
-        determined by the file suffix"""
+        determined by the file suffix
+
+        If colors is given what's saved is a copy reduced to that many
+        colors (see quantize()); this can make XPM files much smaller
+        and faster to save and load."""
         filename = filename if filename is not None else self.filename
         if not filename:
             raise Error("can't save without a filename")
         module = Image._choose_module("can_save", filename)
         if module is not None:
-            module.save(self, filename)
+            module.save(self if colors is None else self.quantize(colors,
+                    dither), filename)
             self.filename = filename
+            _record("save", _codec_name(module))
         else:
             raise Error("no Image module can save files of type {}".format(
                     os.path.splitext(filename)[1]))
@@ -165,6 +281,7 @@ class Image:
         """sets the given pixel to the given color; x and y must be in
         range; color must be an ARGB int"""
         self.pixels[(y * self.width) + x] = color
+        self._sums = None
 
 
     # Bresenham's mid-point line scanning algorithm from 
@@ -205,8 +322,7 @@ class Image:
                 x1 -= 1
                 y0 += 1
                 y1 -= 1
-            for y in range(y0, y1 + 1):
-                self.line(x0, y, x1, y, fill)
+            self._fill_rectangle(min(x0, x1), y0, max(x0, x1), y1, fill)
         if outline is not None:
             self.line(x0, y0, x1, y0, outline)
             self.line(x1, y0, x1, y1, outline)
@@ -228,20 +344,26 @@ class Image:
         width = x1 - x0
         height = y1 - y0
         if fill is not None:
-            # Algorithm based on
-            # http://stackoverflow.com/questions/10322341/
-            # simple-algorithm-for-drawing-filled-ellipse-in-c-c
+            # Scanline fill using integer arithmetic: relative to the
+            # middle a pixel is inside if x²h² + y²w² <= w²h² (where w
+            # and h are the half-width and half-height); the span of
+            # inside pixels only narrows going out from the middle row
+            # so each span's half-width is found by stepping x down from
+            # the previous one
             halfWidth = width // 2
             halfHeight = height // 2
             midX = x0 + halfWidth
             midY = y0 + halfHeight
-            for y in range(-halfHeight, halfHeight + 1):
-                for x in range(-halfWidth, halfWidth + 1):
-                    Δx =  x / halfWidth
-                    Δy =  y / halfHeight
-                    if ((Δx * Δx) + (Δy * Δy)) <= 1:
-                        self.set_pixel(int(round(midX + x)),
-                                       int(round(midY + y)), fill)
+            w2 = halfWidth * halfWidth
+            h2 = halfHeight * halfHeight
+            limit = w2 * h2
+            x = halfWidth
+            for y in range(halfHeight + 1):
+                while (x * x * h2) + (y * y * w2) > limit:
+                    x -= 1
+                self._fill_span(midY + y, midX - x, midX + x, fill)
+                if y:
+                    self._fill_span(midY - y, midX - x, midX + x, fill)
         if outline is not None:
             # Midpoint ellipse algorithm from "Computer Graphics
             # Principles and Practice".
@@ -291,7 +413,21 @@ class Image:
                 ellipse_point(Δx, Δy)
 
 
-    def subsample(self, stride):
+    def _fill_rectangle(self, x0, y0, x1, y1, color):
+        # Fills the rectangle (inclusive coordinates) using the "fill"
+        # backend
+        if y0 > y1 or x0 > x1:
+            return
+        _dispatch("fill", self, x0, y0, x1, y1, color)
+        self._sums = None
+
+
+    def _fill_span(self, y, x0, x1, color):
+        # Fills row y from x0 to x1 inclusive
+        self._fill_rectangle(x0, y, x1, y, color)
+
+
+    def subsample(self, stride, backing=None):
         """returns a subsampled copy of this image.
         
         stride should be at least 2 but not too big; a stride of 2
@@ -300,24 +436,60 @@ class Image:
 
         Subsampling is fairly fast and produces good results for
         photographs: but poor results for text for which scale() is best.
+
+        If backing is given the copy's pixels are memory-mapped from
+        that file (see create()).
         """
         assert (2 <= stride <= min(self.width // 2, self.height // 2) and
                 isinstance(stride, int))
-        pixels = create_array(self.width // stride, self.height // stride)
-        index = 0
-        height = self.height - (self.height % stride)
-        width = self.width - (self.width % stride)
-        for y in range(0, height, stride):
-            offset = y * self.width
-            for x in range(0, width, stride):
-                if index == len(pixels):
-                    break
-                pixels[index] = self.pixels[offset + x]
-                index += 1
-        return self.from_data(self.width // stride, pixels)
+        columns = self.width // stride
+        rows = self.height // stride
+        pixels = create_array(columns, rows, filename=backing)
+        _dispatch("subsample", self, stride, pixels, columns, rows)
+        return self.from_data(columns, pixels)
+
+
+    def subsample_view(self, stride):
+        """returns a 2D (rows x columns) numpy.array view of the pixels
+        subsample() would copy
+
+        This only works if the pixels are in a numpy.array(). No pixels
+        are copied so it is very fast, but changes to this image's pixels
+        show through: use the view's copy() method to get independent
+        pixels.
+        """
+        assert (2 <= stride <= min(self.width // 2, self.height // 2) and
+                isinstance(stride, int))
+        if numpy is None or not isinstance(self.pixels, numpy.ndarray):
+            raise Error("subsample_view() requires numpy pixels")
+        columns = self.width // stride
+        rows = self.height // stride
+        return self.pixels.reshape(self.height, self.width)[
+                :rows * stride:stride, :columns * stride:stride]
+
+
+    def channels(self):
+        """returns four bytes objects holding the α, r, g, and b
+        components of the pixels, row by row
 
+        These are sliced out of the pixels' bytes, so are fast to
+        compute even without numpy, and bytes are cheap to sum() or
+        to slice by row."""
+        data, offsets, itemsize = _pixel_bytes(self.pixels)
+        return tuple(bytes(data[offset::itemsize]) for offset in offsets)
 
-    def scale(self, ratio):
+
+    def set_channels(self, α, r, g, b):
+        """sets the pixels from four bytes-like objects (e.g., as
+        returned by channels()) each holding width x height components
+        """
+        data, offsets, itemsize = _pixel_bytes(self.pixels)
+        for offset, channel in zip(offsets, (α, r, g, b)):
+            data[offset::itemsize] = channel
+        self._sums = None
+
+
+    def scale(self, ratio, workers=1, backing=None):
         """returns a smoothly scaled copy of this image
 
         ratio is how much to scale by, e.g., 0.75 means reduce width and
@@ -325,45 +497,107 @@ class Image:
         of the original size), and so on.
 
         Scaling is slow but produces good results even for text;
-        subsample() is faster.
+        subsample() is faster. If numpy is installed and this image's
+        pixels are in a numpy.array() the scaling is done on whole arrays
+        which is much faster, and if cyImage has been built its
+        multithreaded Cython kernel is faster still: see backends().
+
+        If workers is greater than 1 the output rows are split into
+        bands that are computed by that many processes, with the source
+        and scaled pixels passed through shared memory rather than being
+        pickled; the result is identical to scaling with one worker.
+
+        If backing is given the copy's pixels are memory-mapped from
+        that file (see create()). With numpy the source is read a band
+        of rows at a time so memory use depends on the width not the
+        area (but don't use cache_sums() with huge images).
         """
         assert 0 < ratio < 1
         rows = round(self.height * ratio)
         columns = round(self.width * ratio)
-        pixels = create_array(columns, rows)
-        yStep = self.height / rows
-        xStep = self.width / columns
-        index = 0
-        for row in range(rows):
-            y0 = round(row * yStep)
-            y1 = round(y0 + yStep)
-            for column in range(columns):
-                x0 = round(column * xStep)
-                x1 = round(x0 + xStep)
-                pixels[index] = self._mean(x0, y0, x1, y1)
-                index += 1
+        if workers > 1 and rows > 1 and shared_memory is not None:
+            pixels = _scale_in_processes(self, columns, rows, workers,
+                    backing)
+        else:
+            pixels = create_array(columns, rows, filename=backing)
+            self._scale_rows(pixels, columns, rows, 0, rows, ratio)
         return self.from_data(columns, pixels)
 
 
-    def _mean(self, x0, y0, x1, y1):
-        αTotal, redTotal, greenTotal, blueTotal, count = 0, 0, 0, 0, 0
-        for y in range(y0, y1):
-            if y >= self.height:
-                break
-            offset = y * self.width
-            for x in range(x0, x1):
-                if x >= self.width:
-                    break
-                α, r, g, b = self.argb_for_color(self.pixels[offset + x])
-                αTotal += α
-                redTotal += r
-                greenTotal += g
-                blueTotal += b
-                count += 1
-        α = round(αTotal / count)
-        r = round(redTotal / count)
-        g = round(greenTotal / count)
-        b = round(blueTotal / count)
+    def _scale_rows(self, pixels, columns, rows, start, end, ratio=None):
+        # Sets pixels' rows start to end - 1 of a columns x rows scaling
+        _dispatch("scale", self, pixels, columns, rows, start, end, ratio)
+
+
+    def quantize(self, colors=256, dither=False):
+        """returns a copy of this image with at most colors distinct
+        solid colors (plus transparent where the alpha is 0)
+
+        The palette is chosen by median cut. If dither is True
+        Floyd–Steinberg dithering is used, which looks better for
+        photographs but is slower (especially without numpy)."""
+        image = self.from_data(self.width, _Quantize.quantize(self.pixels,
+                self.width, self.height, colors, dither))
+        image.meta = dict(self.meta)
+        return image
+
+
+    def cache_sums(self, cache=True):
+        """if cache is True scale() keeps a summed-area table for each
+        ARGB channel so that further scale() calls (e.g., at several
+        ratios) compute every box mean in O(1)
+
+        The tables are built on first use and dropped whenever
+        set_pixel(), line(), rectangle() or ellipse() changes the
+        pixels; they use four 64-bit ints per pixel. (Assign to
+        .pixels directly only after calling cache_sums(False).)
+        """
+        self._cacheSums = cache
+        if not cache:
+            self._sums = None
+
+
+    def _summed_areas(self):
+        if self._sums is None:
+            if numpy is not None and isinstance(self.pixels,
+                    numpy.ndarray):
+                self._sums = _Scale.summed_areas(self.pixels, self.width,
+                        self.height)
+            else:
+                self._sums = self._summed_areas_for_array()
+        return self._sums
+
+
+    def _summed_areas_for_array(self):
+        # Each row of a table is the row above plus the running sums of
+        # the channel's row, computed by accumulate() and map()
+        tables = []
+        for channel in self.channels():
+            above = [0] * (self.width + 1)
+            table = array.array("q", above)
+            for offset in range(0, len(channel), self.width):
+                above = list(map(operator.add, above, itertools.accumulate(
+                        itertools.chain((0,), channel[offset:offset +
+                            self.width]))))
+                table.extend(above)
+            tables.append(table)
+        return tables
+
+
+    def _mean_from_sums(self, x0, y0, x1, y1):
+        x1 = min(x1, self.width)
+        y1 = min(y1, self.height)
+        count = (x1 - x0) * (y1 - y0)
+        stride = self.width + 1
+        top = y0 * stride
+        bottom = y1 * stride
+        if isinstance(self._sums, list):
+            tables = self._sums
+        else:
+            tables = self._sums.reshape(4, -1)
+        α, r, g, b = (round(int(table[bottom + x1] - table[top + x1] -
+                      table[bottom + x0] + table[top + x0]) / count)
+                      for table in tables)
         return self.color_for_argb(α, r, g, b)
 
 
@@ -470,6 +704,11 @@ class Image:
 
 
 # Convenience functions
+from_file = Image.from_file
+open_header = Image.open_header
+create = Image.create
+from_data = Image.from_data
+from_backing = Image.from_backing
 argb_for_color = Image.argb_for_color
 rgb_for_color = Image.rgb_for_color
 color_for_argb = Image.color_for_argb
@@ -485,21 +724,471 @@ def sanitized_name(name):
     return name
 
 
-def create_array(width, height, background=None):
+def create_array(width, height, background=None, filename=None):
     """returns an array.array or numpy.array of the correct size and
-    with the given background color"""
+    with the given background color
+
+    If filename is given the file is created (or overwritten) and the
+    array is memory-mapped from it: see map_array()."""
+    if filename is not None:
+        with open(filename, "w+b") as file:
+            file.truncate(width * height * 4)
+        pixels = map_array(filename)
+        if background: # A new file is all 0s, i.e., transparent
+            chunk = array.array(_typecode(), [background]) * (
+                    _MAP_CHUNK_PIXELS)
+            for start in range(0, len(pixels), _MAP_CHUNK_PIXELS):
+                end = min(len(pixels), start + _MAP_CHUNK_PIXELS)
+                pixels[start:end] = chunk[:end - start]
+        return pixels
     if numpy is not None:
         if background is None:
             return numpy.zeros(width * height, dtype=numpy.uint32)
         else:
-            iterable = (background for _ in range(width * height))
-            return numpy.fromiter(iterable, numpy.uint32)
+            return numpy.full(width * height, background,
+                    dtype=numpy.uint32)
     else:
-        # Use the smallest typecode that can store a 32-bit unsigned integer
-        typecode = "I" if array.array("I").itemsize >= 4 else "L"
         background = (background if background is not None else
                       ColorForName["transparent"])
-        return array.array(typecode, [background] * width * height)
+        return array.array(_typecode(), [background]) * (width * height)
+
+
+def _pixel_bytes(pixels):
+    # Returns the pixels' bytes as a writable memoryview, the offsets of
+    # the α, r, g, and b bytes within each pixel, and the pixel size
+    pixels = memoryview(pixels)
+    itemsize = pixels.itemsize
+    offsets = (3, 2, 1, 0) if sys.byteorder == "little" else tuple(
+            itemsize - 4 + i for i in range(4))
+    return pixels.cast("B"), offsets, itemsize
+
+
+def _scale_in_processes(image, columns, rows, workers, backing):
+    # Memory-mapped pixels are opened by the workers from their files;
+    # other pixels are passed through shared memory
+    count = columns * rows
+    memories = []
+    try:
+        source = _shareable(image.pixels, memories)
+        if backing is not None:
+            pixels = create_array(columns, rows, filename=backing)
+            target = ("file", backing)
+        else:
+            memories.append(shared_memory.SharedMemory(create=True,
+                    size=max(1, count * 4)))
+            target = ("memory", memories[-1].name)
+        useNumpy = (numpy is not None and
+                    isinstance(image.pixels, numpy.ndarray))
+        step = math.ceil(rows / workers)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as executor:
+            futures = [executor.submit(_scale_band, source, target,
+                    image.width, image.height, columns, rows, start,
+                    min(rows, start + step), useNumpy)
+                    for start in range(0, rows, step)]
+            for future in concurrent.futures.as_completed(futures):
+                _record("scale", future.result()) # Reraise any exception
+        if backing is None:
+            pixels = create_array(columns, rows)
+            memoryview(pixels).cast("B")[:] = memories[-1].buf[:count * 4]
+        return pixels
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def _shareable(pixels, memories):
+    if (numpy is not None and isinstance(pixels, numpy.memmap) and
+            pixels.filename is not None and pixels.offset == 0 and
+            pixels.size * 4 == os.path.getsize(pixels.filename)):
+        pixels.flush()
+        return ("file", pixels.filename)
+    memory = shared_memory.SharedMemory(create=True,
+            size=max(1, len(pixels) * 4))
+    memory.buf[:len(pixels) * 4] = memoryview(pixels).cast("B")
+    memories.append(memory)
+    return ("memory", memory.name)
+
+
+def _scale_band(source, target, width, height, columns, rows, start,
+        end, useNumpy):
+    # Runs in a worker process: the pixels are only read and each worker
+    # writes a disjoint band of the scaled pixels so no locking is needed
+    memories = []
+    try:
+        pixels = _attach(source, width * height, useNumpy, memories)
+        newPixels = _attach(target, columns * rows, useNumpy, memories)
+        image = Image.from_data(width, pixels)
+        image._scale_rows(newPixels, columns, rows, start, end)
+        if numpy is not None and isinstance(newPixels, numpy.memmap):
+            newPixels.flush()
+        del image, pixels, newPixels # Release the buffers before closing
+        return last_backend("scale")
+    finally:
+        for memory in memories:
+            memory.close()
+
+
+def _attach(shareable, count, useNumpy, memories):
+    kind, name = shareable
+    if kind == "file":
+        return map_array(name)
+    memory = shared_memory.SharedMemory(name=name)
+    memories.append(memory)
+    if useNumpy:
+        return numpy.ndarray((count,), dtype=numpy.uint32,
+                buffer=memory.buf)
+    return memory.buf[:count * 4].cast(_typecode())
+
+
+def map_array(filename):
+    """returns a numpy.memmap of the native-endian 32-bit ARGB words in
+    the given file, or if numpy isn't installed, a memoryview of an
+    mmap.mmap of the file; either way the file is mapped for reading
+    and writing"""
+    if numpy is not None:
+        return numpy.memmap(filename, dtype=numpy.uint32, mode="r+")
+    with open(filename, "r+b") as file:
+        memory = mmap.mmap(file.fileno(), 0)
+    return memoryview(memory).cast(_typecode())
+
+
+# Row streaming
+
+_Header = collections.namedtuple("_Header", "width height meta")
+
+
+def iter_rows(filename):
+    """yields the rows of the image in the file called filename, each
+    a numpy.array or array.array of width ARGB ints (use open_header()
+    to get the width and height)
+
+    If the file's module has a load_rows() function the rows are decoded
+    as they're needed; otherwise the whole image is loaded first."""
+    module = Image._choose_module("can_load", filename)
+    if module is None:
+        raise Error("no Image module can load files of type {}".format(
+                os.path.splitext(filename)[1]))
+    image = Image.open_header(filename)
+    _record("load", _codec_name(module))
+    loadRows = getattr(module, "load_rows", None)
+    if loadRows is not None:
+        yield from loadRows(image, filename)
+    else:
+        pixels = image.pixels
+        for offset in range(0, len(pixels), image.width):
+            yield pixels[offset:offset + image.width]
+
+
+def write_rows(filename, width, height, rows, meta=None):
+    """saves the width x height image whose rows (each a numpy.array or
+    array.array of width ARGB ints) come from the rows iterable to a
+    file called filename; the format is determined by the file suffix
+
+    If the file's module has a save_rows() function each row is written
+    as it comes; otherwise (e.g., for XPM, which must know every color
+    before it can write any pixels) the rows are copied to a
+    memory-mapped temporary file whose image is then saved."""
+    module = Image._choose_module("can_save", filename)
+    if module is None:
+        raise Error("no Image module can save files of type {}".format(
+                os.path.splitext(filename)[1]))
+    meta = dict(meta or {})
+    rows = _checked_rows(rows, width, height)
+    saveRows = getattr(module, "save_rows", None)
+    if saveRows is not None:
+        saveRows(_Header(width, height, meta), filename, rows)
+    else:
+        with tempfile.TemporaryDirectory() as tempdir:
+            pixels = create_array(width, height, filename=os.path.join(
+                    tempdir, "rows"))
+            for y, row in enumerate(rows):
+                pixels[y * width:(y + 1) * width] = row
+            image = Image.from_data(width, pixels)
+            image.meta = meta
+            module.save(image, filename)
+            del image, pixels # Unmap before the file is deleted
+    _record("save", _codec_name(module))
+
+
+def scale_rows(rows, width, height, ratio):
+    """yields the rows of a smoothly scaled copy of the width x height
+    image whose rows come from the rows iterable (e.g., from
+    iter_rows()); the copy is the same as scale() would produce
+
+    Only the source rows that the current scaled row is made from are
+    kept, i.e., about 1 / ratio of them."""
+    assert 0 < ratio < 1
+    newRows = round(height * ratio)
+    columns = round(width * ratio)
+    yStep = height / newRows
+    rows = iter(_checked_rows(rows, width, height))
+    band = collections.deque() # Source rows first to y - 1
+    first = y = 0
+    for row in range(newRows):
+        y0 = round(row * yStep)
+        y1 = min(height, round(y0 + yStep))
+        while y < y1:
+            band.append(next(rows))
+            y += 1
+        while first < y0:
+            band.popleft()
+            first += 1
+        # Scaling this band to a single row gives the same boxes (and so
+        # the same result) as scaling the whole image
+        image = Image.from_data(width, _joined(band))
+        pixels = create_array(columns, 1)
+        image._scale_rows(pixels, columns, 1, 0, 1)
+        yield pixels
+
+
+def _checked_rows(rows, width, height):
+    # Passes on the rows, raising Error if any is the wrong width or if
+    # there are too many or too few of them
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        if count > height or len(row) != width:
+            break
+        yield row
+    else:
+        if count == height:
+            return
+    raise Error("expected {} rows of {} pixels".format(height, width))
+
+
+def _joined(rows):
+    if numpy is not None and isinstance(rows[0], numpy.ndarray):
+        return numpy.concatenate(rows)
+    pixels = array.array(_typecode())
+    for row in rows:
+        pixels.frombytes(memoryview(row).cast("B"))
+    return pixels
+
+
+# Backends
+#
+# scale(), subsample(), and the rectangle and ellipse fills are each
+# served by the first of the registered implementations (in descending
+# priority order) that can handle the image; an implementation that
+# can't (e.g., a numpy one given an array.array) returns NotImplemented.
+# Loading and saving are served by the modules whose can_load() and
+# can_save() rate highest, as described at the top.
+
+_Backends = collections.defaultdict(list) # operation: [(priority, name,
+                                          #             function)]
+_Preferred = {} # operation (or None for all): [name, ...]
+_Ordered = {} # operation: [(name, function), ...] with preferences
+_served = threading.local()
+
+
+def register_backend(operation, name, function, priority=0):
+    """registers function as the implementation called name of the
+    given operation ("scale", "subsample", or "fill"), replacing any
+    existing one of the same name
+
+    The function receives the same arguments as the built-in
+    implementations (see _scale_python(), _subsample_python(), and
+    _fill_python()) and must return NotImplemented if it can't handle
+    them."""
+    backends = [backend for backend in _Backends[operation]
+                if backend[1] != name]
+    backends.append((priority, name, function))
+    backends.sort(key=lambda backend: backend[0], reverse=True)
+    _Backends[operation] = backends
+    _Ordered.clear()
+
+
+def prefer_backends(preferences):
+    """sets which backends to try first: preferences is a comma-separated
+    str of backend names (preferred for every operation) and
+    operation=name pairs, e.g., "python" or "numpy,scale=cython"
+
+    The preferences are read from the IMAGE_BACKENDS environment
+    variable when Image is imported. Preferred backends are tried in the
+    order given followed by the others, so an operation is still served
+    if a preferred backend is unavailable or declines."""
+    _Preferred.clear()
+    for preference in preferences.split(","):
+        operation, _, name = preference.strip().rpartition("=")
+        if name:
+            _Preferred.setdefault(operation or None, []).append(name)
+    _Ordered.clear()
+
+
+def backends(operation):
+    """returns the names of the available implementations of the given
+    operation in the order they are tried"""
+    return [name for name, _ in _ordered(operation)]
+
+
+def last_backend(operation):
+    """returns the name of the implementation that served this thread's
+    most recent call of the given operation ("scale", "subsample",
+    "fill", "load", or "save"), or None if there hasn't been one; for
+    "load" and "save" this is the name of the module used, e.g., "Xpm"
+    """
+    return getattr(_served, operation, None)
+
+
+def _ordered(operation):
+    ordered = _Ordered.get(operation)
+    if ordered is None:
+        preferred = (_Preferred.get(operation, []) +
+                     _Preferred.get(None, []))
+        rank = {name: i for i, name in reversed(list(enumerate(
+                preferred)))}
+        backends = sorted(_Backends[operation], key=lambda backend:
+                rank.get(backend[1], len(rank)))
+        ordered = _Ordered[operation] = [(name, function) for _, name,
+                                         function in backends]
+    return ordered
+
+
+def _dispatch(operation, *args):
+    for name, function in _ordered(operation):
+        result = function(*args)
+        if result is not NotImplemented:
+            _record(operation, name)
+            return result
+    raise Error("no backend can {} these pixels".format(operation))
+
+
+def _record(operation, name):
+    setattr(_served, operation, name)
+
+
+def _codec_name(module):
+    return module.__name__.rpartition(".")[2]
+
+
+def _scale_python(image, pixels, columns, rows, start, end, ratio):
+    # Each output row's band of source rows is added up column by column
+    # for each channel with map(), and then each box's total is the sum()
+    # of a slice of that
+    width = image.width
+    yStep = image.height / rows
+    xStep = width / columns
+    boxes = []
+    for column in range(columns):
+        x0 = round(column * xStep)
+        boxes.append((x0, min(width, round(x0 + xStep))))
+    if image._cacheSums:
+        image._summed_areas()
+    else:
+        channels = image.channels()
+    index = start * columns
+    for row in range(start, end):
+        y0 = round(row * yStep)
+        y1 = min(image.height, round(y0 + yStep))
+        if image._cacheSums:
+            for x0, x1 in boxes:
+                pixels[index] = image._mean_from_sums(x0, y0, x1, y1)
+                index += 1
+            continue
+        bands = []
+        for channel in channels:
+            band = channel[y0 * width:(y0 + 1) * width]
+            for offset in range((y0 + 1) * width, y1 * width, width):
+                band = list(map(operator.add, band, channel[offset:offset +
+                        width]))
+            bands.append(band)
+        αs, reds, greens, blues = bands
+        for x0, x1 in boxes:
+            count = (y1 - y0) * (x1 - x0)
+            pixels[index] = ((round(sum(αs[x0:x1]) / count) << 24) |
+                             (round(sum(reds[x0:x1]) / count) << 16) |
+                             (round(sum(greens[x0:x1]) / count) << 8) |
+                             round(sum(blues[x0:x1]) / count))
+            index += 1
+
+
+def _scale_numpy(image, pixels, columns, rows, start, end, ratio):
+    if numpy is None or not isinstance(image.pixels, numpy.ndarray):
+        return NotImplemented
+    if image._cacheSums:
+        _Scale.scale_from_sums(image._summed_areas(), image.width,
+                image.height, pixels, columns, rows, start, end)
+    else:
+        _Scale.scale(image.pixels, image.width, image.height, pixels,
+                columns, rows, start, end)
+
+
+def _scale_cython(image, pixels, columns, rows, start, end, ratio):
+    # The Cython kernel scales the whole image by the ratio and rounds
+    # the box boundaries' halves away from zero, so it is only used if
+    # that gives the same size and boxes (it is asked to round the means
+    # halves to even like the others); summed areas are left to numpy
+    # since they're faster still
+    if (ratio is None or not isinstance(image.pixels, numpy.ndarray) or
+            image._cacheSums or start != 0 or end != rows):
+        return NotImplemented
+    for length, count in ((image.width, columns), (image.height, rows)):
+        if math.floor((length * ratio) + 0.5) != count:
+            return NotImplemented
+        starts, ends = _Scale.bounds(length, count)
+        step = length / count
+        halfUp = numpy.floor((numpy.arange(count) * step) + 0.5)
+        if (not numpy.array_equal(starts, halfUp) or not
+                numpy.array_equal(ends, numpy.minimum(length,
+                    numpy.floor(halfUp + step + 0.5)))):
+            return NotImplemented
+    _, newPixels = _cyScale.scale(numpy.ascontiguousarray(image.pixels,
+            dtype=numpy.uint32), image.width, image.height, ratio, True)
+    pixels[:] = newPixels
+
+
+def _subsample_python(image, stride, pixels, columns, rows):
+    # Copies each row's strided slice straight from the source's buffer
+    # (memoryview slices don't copy)
+    source = memoryview(image.pixels)
+    target = memoryview(pixels)
+    width = columns * stride
+    for row in range(rows):
+        offset = row * stride * image.width
+        target[row * columns:(row + 1) * columns] = source[
+                offset:offset + width:stride]
+
+
+def _subsample_numpy(image, stride, pixels, columns, rows):
+    if numpy is None or not isinstance(image.pixels, numpy.ndarray):
+        return NotImplemented
+    pixels.reshape(rows, columns)[:] = image.subsample_view(stride)
+
+
+def _fill_python(image, x0, y0, x1, y1, color):
+    # Fills the rectangle (inclusive coordinates) a row at a time with
+    # slice assignments
+    span = array.array(_typecode(), [color]) * (x1 - x0 + 1)
+    for y in range(y0, y1 + 1):
+        offset = y * image.width
+        image.pixels[offset + x0:offset + x1 + 1] = span
+
+
+def _fill_numpy(image, x0, y0, x1, y1, color):
+    # Fills the rectangle all at once, or if the x coordinates are out
+    # of range (so wrap onto the adjacent rows) a row at a time
+    if numpy is None or not isinstance(image.pixels, numpy.ndarray):
+        return NotImplemented
+    if 0 <= x0 and x1 < image.width:
+        pixels = image.pixels.reshape(image.height, image.width)
+        pixels[y0:y1 + 1, x0:x1 + 1] = color
+    else:
+        for y in range(y0, y1 + 1):
+            offset = y * image.width
+            image.pixels[offset + x0:offset + x1 + 1] = color
+
+
+register_backend("scale", "python", _scale_python)
+register_backend("subsample", "python", _subsample_python)
+register_backend("fill", "python", _fill_python)
+if numpy is not None:
+    register_backend("scale", "numpy", _scale_numpy, 10)
+    register_backend("subsample", "numpy", _subsample_numpy, 10)
+    register_backend("fill", "numpy", _fill_numpy, 10)
+    if _cyScale is not None:
+        register_backend("scale", "cython", _scale_cython, 20)
+prefer_backends(os.environ.get("IMAGE_BACKENDS", ""))
 
 
 # Taken from rgb.txt and converted to ARGB (with the addition of
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+A ladder of scaled copies of an image, e.g., 1600, 800, 400, and 128
+pixel versions, made by decoding the image only once.
+
+The rungs are made largest first. With smooth scaling each is scaled
+from the one before (or from the original for the first), so only the
+first scaling works on all the original's pixels; the ratio is chosen
+to give the size that scaling the original would (the rung before's
+rounding could otherwise make it a pixel out), and in the few cases
+that no ratio does the original is scaled instead. Otherwise each is
+subsampled from the original (strides from the rung before would
+multiply, giving smaller images than a single size would), which only
+reads the pixels it keeps. Either way each rung is the size a single
+size would give. A rung that the image already fits is a copy (of the
+original file if it hasn't been changed, there's no color reduction,
+and it's in the same format).
+
+Each rung's filename comes from a pattern which may use {name} (the
+original's filename), {stem} and {ext} (its filename without and with
+only its suffix), and {size}; patterns may include subdirectories.
+
+    rungs = Ladder.parse_sizes("1600,800,400,128:{stem}-thumb{ext}")
+    for name in os.listdir(source):
+        targets = [(size, Ladder.target_for(target, name, size, pattern))
+                   for size, pattern in rungs]
+        for result in Ladder.scale(os.path.join(source, name), targets):
+            ...
+"""
+
+import collections
+import math
+import os
+import shutil
+import Image
+
+
+PATTERN = "{stem}-{size}{ext}"
+
+Result = collections.namedtuple("Result", "copied scaled name")
+
+
+def parse_sizes(text, pattern=PATTERN):
+    """returns a list of (size, pattern) pairs largest first for text of
+    comma-separated SIZE or SIZE:PATTERN items, using the given pattern
+    for SIZEs without one; raises ValueError if the text is invalid or
+    two rungs would have the same filename"""
+    rungs = []
+    for item in text.split(","):
+        size, _, itemPattern = item.strip().partition(":")
+        size = int(size)
+        if size < 1:
+            raise ValueError("invalid size {}".format(size))
+        rungs.append((size, itemPattern or pattern))
+    rungs.sort(key=lambda rung: rung[0], reverse=True)
+    names = set()
+    for size, rungPattern in rungs:
+        try:
+            name = target_for("", "x.xpm", size, rungPattern)
+        except (KeyError, IndexError, ValueError) as err:
+            raise ValueError("invalid pattern {}: {}".format(rungPattern,
+                    err))
+        if name in names:
+            raise ValueError("more than one size uses the name {}".format(
+                    rungPattern))
+        names.add(name)
+    return rungs
+
+
+def target_for(target, name, size, pattern):
+    """returns the filename in the target directory of the rung of the
+    given size for the image called name"""
+    stem, ext = os.path.splitext(name)
+    return os.path.join(target, pattern.format(name=name, stem=stem,
+            ext=ext, size=size))
+
+
+def scale(sourceImage, targets, smooth=False, colors=None, dither=False):
+    """makes the rungs for sourceImage and returns a Result for each
+
+    targets is a list of (size, targetImage) pairs largest first; a rung
+    whose targetImage is None is only made if a later one needs it, and
+    isn't saved. Smooth scaling is slow but good for text; colors and
+    dither are passed to Image.save()."""
+    while targets and targets[-1][1] is None:
+        targets = targets[:-1]
+    results = []
+    original = image = Image.open_header(sourceImage)
+    for size, targetImage in targets:
+        if not smooth:
+            image = original
+        copy = image.width <= size and image.height <= size
+        if not copy:
+            if smooth:
+                ratio = min(size / original.width, size / original.height)
+                ratioFromRung = _ratio_for(image, round(original.width *
+                        ratio), round(original.height * ratio))
+                if image is original or ratioFromRung is None:
+                    image = original.scale(ratio)
+                else:
+                    image = image.scale(ratioFromRung)
+            else:
+                image = image.subsample(int(math.ceil(max(
+                        image.width / size, image.height / size))))
+        if targetImage is not None:
+            directory = os.path.dirname(targetImage)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if (image is original and colors is None and
+                    _suffix(sourceImage) == _suffix(targetImage)):
+                shutil.copyfile(sourceImage, targetImage) # Not decoded
+            else:
+                image.save(targetImage, colors, dither)
+            results.append(Result(int(copy), int(not copy), targetImage))
+    return results
+
+
+def _ratio_for(image, width, height):
+    # Returns the ratio in the middle of those that scale the image to
+    # width x height, or None if there aren't any
+    low = max((width - 0.5) / image.width, (height - 0.5) / image.height)
+    high = min((width + 0.5) / image.width, (height + 0.5) / image.height)
+    ratio = (low + high) / 2
+    if (low < high and ratio < 1 and round(image.width * ratio) == width
+            and round(image.height * ratio) == height):
+        return ratio
+    return None
+
+
+def _suffix(filename):
+    return os.path.splitext(filename)[1].lower()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+A manifest of the images that the imagescale programs have made, so
+that a rerun can skip those whose source and parameters are unchanged
+without even listing them as jobs.
+
+The manifest is a JSON file in the target directory. For each image
+(keyed by its path relative to the target directory) it records the
+source's modification time, size, and BLAKE2 hash, the target's size,
+and the parameters (e.g., the size and smoothing) it was made with. An
+image is current if the parameters are the same, the target still has
+the recorded size, and the source has the recorded modification time
+and size; if only the modification time differs (e.g., because the
+source was copied or touched) the source is hashed and is current if
+its hash is the same.
+
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=smooth))
+    for name in os.listdir(source):
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            ... # Make targetImage from sourceImage
+            manifest.record(targetImage)
+    manifest.save()
+"""
+
+import hashlib
+import json
+import os
+import threading
+import Qtrac
+
+
+FILENAME = ".imagescale-manifest.json"
+_VERSION = 1
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+class Manifest:
+
+    def __init__(self, target, parameters, force=False):
+        """reads the manifest in the target directory if there is one
+        (unless force is True, in which case no image is current)
+
+        parameters is a dict of JSON-compatible values; images made with
+        different parameters aren't current. is_current() and record()
+        may be called from several threads at once."""
+        self.target = target
+        self.filename = os.path.join(target, FILENAME)
+        self.parameters = parameters
+        self.current = 0 # How many is_current() calls returned True
+        self._entries = {}
+        self._pending = {} # name: [source, mtime, size, hash or None]
+        self._lock = threading.Lock() # Files are read outside it
+        if not force:
+            self._load()
+
+
+    def _load(self):
+        try:
+            with open(self.filename, "rt", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") == _VERSION:
+                self._entries = data["images"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            self._entries = {} # A missing or bad manifest is ignored
+
+
+    def is_current(self, sourceImage, targetImage):
+        """returns True if targetImage was made from sourceImage as it
+        is now and with the same parameters; if it isn't the source's
+        details are noted for record()"""
+        name = os.path.relpath(targetImage, self.target)
+        stat = os.stat(sourceImage)
+        pending = [sourceImage, stat.st_mtime_ns, stat.st_size, None]
+        with self._lock:
+            entry = self._entries.get(name)
+        if (entry is None or entry["parameters"] != self.parameters or
+                entry["size"] != stat.st_size or
+                entry["target_size"] != _size(targetImage)):
+            return self._stale(name, pending)
+        if entry["mtime"] != stat.st_mtime_ns:
+            pending[3] = _hash(sourceImage)
+            if entry["hash"] != pending[3]:
+                return self._stale(name, pending)
+        with self._lock:
+            entry["mtime"] = stat.st_mtime_ns # So it isn't rehashed
+            self.current += 1
+        return True
+
+
+    def _stale(self, name, pending):
+        with self._lock:
+            self._pending[name] = pending
+        return False
+
+
+    def record(self, targetImage):
+        """records that targetImage has been made from the source that
+        was passed with it to is_current() (which returned False)"""
+        name = os.path.relpath(targetImage, self.target)
+        with self._lock:
+            sourceImage, mtime, size, sourceHash = self._pending.pop(name)
+        if sourceHash is None:
+            sourceHash = _hash(sourceImage)
+        entry = dict(mtime=mtime, size=size, hash=sourceHash,
+                target_size=_size(targetImage), parameters=self.parameters)
+        with self._lock:
+            self._entries[name] = entry
+
+
+    def save(self):
+        """writes the manifest, replacing the old one only once the new
+        one is complete"""
+        filename = self.filename + ".tmp"
+        try:
+            with open(filename, "wt", encoding="utf-8") as file, \
+                    self._lock:
+                json.dump(dict(version=_VERSION, images=self._entries),
+                        file, sort_keys=True, separators=(",", ":"))
+            os.replace(filename, self.filename)
+        except BaseException:
+            Qtrac.remove_if_exists(filename)
+            raise
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return None
+
+
+def _hash(filename):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -13,6 +13,7 @@ import abc
 import collections
 import errno
 import functools
+import math
 import os
 import sys
 
@@ -96,3 +97,10 @@ def report(message="", error=False):
         message = message[:67] + "..."
     sys.stdout.write("\r{:70}{}".format(message, "\n" if error else ""))
     sys.stdout.flush()
+
+
+def percentile(values, percent):
+    """returns the nearest-rank percentile of the values"""
+    values = sorted(values)
+    rank = max(1, math.ceil(len(values) * percent / 100))
+    return values[rank - 1]
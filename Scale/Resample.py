@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+Separable resampling of ARGB pixels using a choice of filter kernels.
+
+Unlike scale() this can enlarge as well as reduce, and can use different
+ratios for the width and height. The image is resampled horizontally and
+then vertically. For each axis the source pixels and weights that
+contribute to each output pixel are computed once up front, so the passes
+themselves are just weighted sums: these are done with numpy, or with
+Scale.Fast.resample_rows() if it has been built.
+"""
+
+import math
+import numpy
+try:
+    from Scale.Scale.Fast import resample_rows
+except ImportError:
+    resample_rows = None
+
+
+MAX_COMPONENT = 0xFF
+SHIFTS = (24, 16, 8, 0) # α, r, g, b
+
+
+def _box(x):
+    return ((-0.5 <= x) & (x < 0.5)).astype(numpy.float64)
+
+
+def _bilinear(x):
+    return numpy.maximum(0, 1 - numpy.abs(x))
+
+
+def _bicubic(x, a=-0.5):
+    x = numpy.abs(x)
+    x2 = x * x
+    x3 = x2 * x
+    return numpy.where(x < 1, ((a + 2) * x3) - ((a + 3) * x2) + 1,
+            numpy.where(x < 2, (a * x3) - (5 * a * x2) + (8 * a * x) -
+                (4 * a), 0))
+
+
+def _lanczos3(x):
+    return numpy.where(numpy.abs(x) < 3, numpy.sinc(x) * numpy.sinc(x / 3),
+            0)
+
+
+# Each kernel's support (half-width) and function
+KERNELS = {"box": (0.5, _box), "bilinear": (1, _bilinear),
+        "bicubic": (2, _bicubic), "lanczos3": (3, _lanczos3)}
+
+
+def resample(pixels, width, height, xRatio, yRatio=None,
+        kernel="bicubic"):
+    """returns the number of columns and the pixels of a resampled copy
+    of the given pixels
+
+    xRatio and yRatio are how much to scale the width and height by,
+    e.g., 2 doubles and 0.5 halves; if yRatio is None it is the same as
+    xRatio. kernel is one of "box", "bilinear", "bicubic", or
+    "lanczos3".
+    """
+    if yRatio is None:
+        yRatio = xRatio
+    assert xRatio > 0 and yRatio > 0 and kernel in KERNELS
+    columns = max(1, round(width * xRatio))
+    rows = max(1, round(height * yRatio))
+    xIndexes, xWeights = weights(width, columns, kernel)
+    yIndexes, yWeights = weights(height, rows, kernel)
+    source = numpy.asarray(pixels, dtype=numpy.uint32).reshape(height,
+            width)
+    planes = numpy.empty((len(SHIFTS), height, width), dtype=numpy.float64)
+    for plane, shift in zip(planes, SHIFTS):
+        plane[:] = (source >> shift) & MAX_COMPONENT
+    planes = _resample_rows(planes, xIndexes, xWeights)
+    planes = _resample_rows(planes.transpose(0, 2, 1), yIndexes,
+            yWeights).transpose(0, 2, 1)
+    newPixels = numpy.zeros(rows * columns, dtype=numpy.uint32)
+    for plane, shift in zip(planes, SHIFTS):
+        components = numpy.clip(numpy.rint(plane), 0, MAX_COMPONENT)
+        newPixels |= components.astype(numpy.uint32).reshape(-1) << (
+                numpy.uint32(shift))
+    return columns, newPixels
+
+
+def weights(sourceSize, targetSize, kernel):
+    """returns two (targetSize x taps) numpy.arrays, the first holding
+    the indexes of the source pixels that contribute to each target
+    pixel, and the second their normalized weights
+
+    When reducing, the kernel is widened so that every source pixel
+    contributes; source indexes beyond the edges are clamped.
+    """
+    support, function = KERNELS[kernel]
+    ratio = targetSize / sourceSize
+    stretch = max(1.0, 1 / ratio)
+    radius = support * stretch
+    taps = int(math.ceil(radius * 2)) + 1
+    centers = (numpy.arange(targetSize) + 0.5) / ratio
+    starts = numpy.floor(centers - radius).astype(numpy.intp)
+    positions = starts[:, None] + numpy.arange(taps)[None, :]
+    tapWeights = function((positions + 0.5 - centers[:, None]) / stretch)
+    totals = tapWeights.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1
+    return (numpy.clip(positions, 0, sourceSize - 1),
+            tapWeights / totals)
+
+
+def _resample_rows(planes, indexes, tapWeights):
+    # Resamples the last axis of the (channels x rows x columns) planes
+    if resample_rows is not None:
+        return numpy.asarray(resample_rows(numpy.ascontiguousarray(planes),
+                indexes, tapWeights))
+    result = numpy.zeros(planes.shape[:2] + (indexes.shape[0],),
+            dtype=numpy.float64)
+    for tap in range(indexes.shape[1]):
+        result += planes[:, :, indexes[:, tap]] * tapWeights[:, tap]
+    return result
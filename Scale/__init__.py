@@ -10,4 +10,8 @@
 # General Public License for more details.
 
 from Scale.Slow import scale as scale_slow
-from Scale.Scale.Fast import scale as scale_fast
+try:
+    from Scale.Scale.Fast import scale as scale_fast
+except ImportError: # Not built
+    scale_fast = None
+from Scale.Resample import resample
@@ -14,10 +14,7 @@ import os
 import re
 import tempfile
 import Qtrac
-try:
-    import cyImage as Image
-except ImportError:
-    import Image
+import Image
 
 
 def main():
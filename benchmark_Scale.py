@@ -9,119 +9,254 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
 # General Public License for more details.
 
+"""
+Benchmarks Image, cyImage, Scale.scale_slow(), and Scale.scale_fast()
+(whichever are available) on synthetic images of the given sizes and on
+any image files given on the command line: loading and saving in each
+format, scaling at the given ratios, subsampling, and drawing.
+
+Each benchmark is run a few times to warm up, then timed over several
+runs, reporting the median and 95th percentile wall times, and then run
+once more under tracemalloc to find its peak memory use. The results
+can be saved as JSON and compared with a previously saved baseline, in
+which case any benchmark whose median is slower than the baseline's by
+more than the threshold is reported as a regression (and the exit code
+is 1).
+"""
+
 import argparse
-import cProfile
+import collections
+import datetime
+import json
 import os
+import platform
+import re
+import shutil
+import statistics
 import sys
 import tempfile
 import time
+import tracemalloc
 import Image
-import Scale
+import Qtrac
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     import cyImage
 except ImportError:
     cyImage = None
+try:
+    import Scale
+except ImportError:
+    Scale = None
+
 
-SHOW_SAVE_TIME = False
+Benchmark = collections.namedtuple("Benchmark", "name function")
+Result = collections.namedtuple("Result", "median p95 peak runs")
 
 
 def main():
+    args = handle_commandline()
+    tempdir = tempfile.mkdtemp()
+    try:
+        results = run(get_benchmarks(args, tempdir), args)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "rt", encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+    regressions = report(results, baseline, args.threshold)
+    if args.output:
+        save(args.output, results)
+    sys.exit(1 if regressions else 0)
+
+
+def handle_commandline():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-P", "--noprofile", action="store_true",
-            help="only use inside a regression.py file")
-    parser.add_argument("image", nargs="?", default=os.path.join(
-            os.path.dirname(__file__), "regressiondata/photo.xpm"),
-            help="image filename [default %(default)s]")
+    parser.add_argument("images", nargs="*",
+            help="image files to benchmark as well as the synthetic "
+                "images")
+    parser.add_argument("-s", "--sizes", default="128x96,640x480",
+            help="comma-separated WxH synthetic image sizes "
+                "[default: %(default)s]")
+    parser.add_argument("-r", "--ratios", default="0.75,0.5,0.1",
+            help="comma-separated scale ratios [default: %(default)s]")
+    parser.add_argument("-n", "--repeat", default=5, type=int,
+            help="timed runs per benchmark [default: %(default)d]")
+    parser.add_argument("-w", "--warmup", default=1, type=int,
+            help="untimed runs per benchmark [default: %(default)d]")
+    parser.add_argument("-m", "--match",
+            help="only run benchmarks whose names match this regex")
+    parser.add_argument("-o", "--output",
+            help="save the results to this JSON file")
+    parser.add_argument("-b", "--baseline",
+            help="compare the results with this JSON file's results")
+    parser.add_argument("-t", "--threshold", default=10, type=float,
+            help="percentage slowdown versus the baseline that counts "
+                "as a regression [default: %(default).0f]")
     args = parser.parse_args()
-    profile = not args.noprofile
+    try:
+        args.sizes = [tuple(int(x) for x in size.lower().split("x"))
+                      for size in args.sizes.split(",")]
+        args.ratios = [float(ratio) for ratio in args.ratios.split(",")]
+    except ValueError as err:
+        parser.error(str(err))
+    if args.repeat < 1:
+        parser.error("at least one timed run is needed")
+    return args
 
-    if SHOW_SAVE_TIME:
-        print("Loading", args.image, end="")
-    start = time.time()
-    image = Image.Image.from_file(args.image)
-    end = time.time() - start
-    if SHOW_SAVE_TIME:
-        print("\rLoaded with Image in {:.3f} sec{}".format(end,
-                " " * len(args.image)))
 
+def get_benchmarks(args, tempdir):
+    modules = [("Image", Image)]
     if cyImage is not None:
-        if SHOW_SAVE_TIME:
-            print("Loading", args.image, end="")
-        start = time.time()
-        image1 = cyImage.Image.from_file(args.image)
-        end = time.time() - start
-        if SHOW_SAVE_TIME:
-            print("\rLoaded with cyImage in {:.3f} sec{}".format(end,
-                    " " * len(args.image)))
-
-    if profile:
-        print("Scaling using Image.scale()...")
-        cProfile.runctx("image.scale(0.5)", globals(), locals())
-        if cyImage is not None:
-            print("Scaling using cyImage.scale()...")
-            cProfile.runctx("image1.scale(0.5)", globals(), locals())
-
-    filenames = []
-    for name, function in (("Scale.scale_slow", Scale.scale_slow),
-            ("Scale.scale_fast", Scale.scale_fast)):
-        scale(image, name, profile)
-        filenames.append((os.path.splitext(name)[1][1:], function))
-
-    if profile and SHOW_SAVE_TIME:
-        print("Saving rescaled images...")
-    filename = os.path.join(tempfile.gettempdir(), "scale.xpm")
-
-    start = time.time()
-    scaled = image.scale(0.5)
-    end = time.time() - start
-    if not profile:
-        print("Scaled with Image.scale() in {:.3f} sec".format(end))
-    if SHOW_SAVE_TIME:
-        start = time.time()
-        scaled.save(filename)
-        end = time.time() - start
-        print("Saved {} with Image.save() in {:.3f} sec".format(filename,
-                end))
+        modules.append(("cyImage", cyImage))
+    subjects = [("{}x{}".format(width, height),
+                 lambda module, width=width, height=height:
+                     synthetic_image(module, width, height))
+                for width, height in args.sizes]
+    subjects += [(os.path.basename(filename),
+                  lambda module, filename=filename:
+                      module.Image.from_file(filename))
+                 for filename in args.images]
+    match = re.compile(args.match) if args.match else None
+    for label, make_image in subjects:
+        for moduleName, module in modules:
+            image = make_image(module)
+            for benchmark in image_benchmarks(moduleName, module, image,
+                    args.ratios, tempdir):
+                name = "{} {}".format(benchmark.name, label)
+                if match is None or match.search(name):
+                    yield Benchmark(name, benchmark.function)
+        if Scale is not None:
+            image = make_image(Image)
+            pixels = numpy.asarray(image.pixels, dtype=numpy.uint32)
+            for functionName, function in (
+                    ("Scale.scale_slow", Scale.scale_slow),
+                    ("Scale.scale_fast", Scale.scale_fast)):
+                if function is None: # Scale.Fast hasn't been built
+                    continue
+                for ratio in args.ratios:
+                    name = "{} scale({}) {}".format(functionName, ratio,
+                            label)
+                    if match is None or match.search(name):
+                        yield Benchmark(name, lambda function=function,
+                                pixels=pixels, image=image, ratio=ratio:
+                                    function(pixels, image.width,
+                                        image.height, ratio))
 
-    if cyImage is not None:
-        start = time.time()
-        scaled1 = image1.scale(0.5)
-        end = time.time() - start
-        if not profile:
-            print("Scaled with cyImage.scale() in {:.3f} sec".format(end))
-        if SHOW_SAVE_TIME:
-            start = time.time()
-            scaled1.save(filename)
-            end = time.time() - start
-            print("Saved {} with cyImage.save() in {:.3f} sec".format(
-                    filename, end))
-
-    for filename, function in filenames:
-        save(image, filename, function, profile)
-
-
-def scale(image, function, profile):
-    if profile:
-        print("Scaling using {}()...".format(function))
-        cProfile.runctx("{}(image.pixels, image.width, "
-                "image.height, 0.5)".format(function), globals(), locals())
-
-
-def save(image, name, function, profile):
-    filename = os.path.join(tempfile.gettempdir(), name + ".xpm")
-    start = time.time()
-    width, pixels = function(image.pixels, image.width, image.height, 0.5)
-    end = time.time() - start
-    if not profile:
-        print("Scaled with {}() in {:.3f} sec".format(name, end))
-    if SHOW_SAVE_TIME:
-        image = Image.Image.from_data(width, pixels)
-        start = time.time()
-        image.save(filename)
-        end = time.time() - start
-        print("Saved {} in {:.3f} sec".format(filename, end))
+
+def image_benchmarks(moduleName, module, image, ratios, tempdir):
+    suffixes = [".xpm", ".xbm"]
+    if moduleName == "Image":
+        suffixes += [suffix for suffix in (".png", ".argb")
+                     if Image.Image._choose_module("can_save",
+                         "x" + suffix) is not None]
+    for suffix in suffixes:
+        filename = os.path.join(tempdir, moduleName + suffix)
+        image.save(filename) # Make sure there's something to load
+        yield Benchmark("{} save {}".format(moduleName, suffix[1:]),
+                lambda filename=filename: image.save(filename))
+        yield Benchmark("{} load {}".format(moduleName, suffix[1:]),
+                lambda filename=filename: module.Image.from_file(
+                    filename))
+    for ratio in ratios:
+        yield Benchmark("{} scale({})".format(moduleName, ratio),
+                lambda ratio=ratio: image.scale(ratio))
+    for stride in (2, 4):
+        if stride <= min(image.width // 2, image.height // 2):
+            yield Benchmark("{} subsample({})".format(moduleName, stride),
+                    lambda stride=stride: image.subsample(stride))
+    canvas = module.Image.create(image.width, image.height)
+    x1 = image.width - 1
+    y1 = image.height - 1
+    yield Benchmark("{} line".format(moduleName),
+            lambda: canvas.line(0, 0, x1, y1, 0xFF0000FF))
+    yield Benchmark("{} rectangle".format(moduleName),
+            lambda: canvas.rectangle(0, 0, x1, y1, outline=0xFF000000,
+                fill=0xFF00FF00))
+    yield Benchmark("{} ellipse".format(moduleName),
+            lambda: canvas.ellipse(0, 0, x1, y1, outline=0xFF000000,
+                fill=0xFFFF0000))
+
+
+def synthetic_image(module, width, height):
+    """returns a reproducible image with a modest number of colors (so
+    that XPM files are realistic) and some shapes"""
+    image = module.Image.create(width, height)
+    for y in range(height):
+        red = (y * 8 // height) * 32
+        for x in range(width):
+            green = (x * 8 // width) * 32
+            blue = ((x + y) % 4) * 64
+            image.pixels[(y * width) + x] = (0xFF000000 | (red << 16) |
+                    (green << 8) | blue)
+    image.rectangle(width // 8, height // 8, width // 2, height // 2,
+            outline=0xFF000000, fill=0xFFFFFFFF)
+    image.ellipse(width // 3, height // 3, width - 2, height - 2,
+            outline=0xFF000000, fill=0xFFFFFF00)
+    return image
+
+
+def run(benchmarks, args):
+    results = collections.OrderedDict()
+    for benchmark in benchmarks:
+        progress = "{}...".format(benchmark.name)
+        print(progress, end="", flush=True)
+        for _ in range(args.warmup):
+            benchmark.function()
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            benchmark.function()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            benchmark.function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[benchmark.name] = Result(statistics.median(times),
+                Qtrac.percentile(times, 95), peak, len(times))
+        print("\r{}\r".format(" " * len(progress)), end="")
+    return results
+
+
+def report(results, baseline, threshold):
+    regressions = 0
+    width = max((len(name) for name in results), default=4)
+    print("{:{}} {:>10} {:>10} {:>10}{}".format("Name", width, "Median",
+            "P95", "Peak KB", " Change" if baseline is not None else ""))
+    for name, result in results.items():
+        line = "{:{}} {:>9.4f}s {:>9.4f}s {:>10,}".format(name, width,
+                result.median, result.p95, result.peak // 1024)
+        if baseline is not None and name in baseline:
+            before = baseline[name]["median"]
+            change = ((result.median - before) / before * 100 if before
+                      else 0)
+            line += " {:>+6.1f}%".format(change)
+            if change > threshold:
+                line += " REGRESSION"
+                regressions += 1
+        print(line)
+    if baseline is not None:
+        print("{} regression{} (threshold {:.0f}%)".format(regressions,
+                "" if regressions == 1 else "s", threshold))
+    return regressions
+
+
+def save(filename, results):
+    data = dict(meta=dict(date=datetime.datetime.now().isoformat(),
+            python=platform.python_version(), platform=platform.platform(),
+            numpy=numpy.__version__ if numpy is not None else None,
+            cyImage=cyImage is not None, Scale=Scale is not None),
+            results={name: result._asdict() for name, result in
+                     results.items()})
+    with open(filename, "wt", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
 
 
 if __name__ == "__main__":
     main()
-
@@ -184,23 +184,31 @@ class Image:
             y0, y1 = y1, y0
         cdef int width = x1 - x0
         cdef int height = y1 - y0
-        cdef int halfWidth, halfHeight, midX, midY
+        cdef int halfWidth, halfHeight, midX, midY, x, y
+        cdef long long w2, h2, limit
         cdef double dx, dy, a, b, a2, b2, p
         if fill is not None:
-            # Algorithm based on
-            # http://stackoverflow.com/questions/10322341/
-            # simple-algorithm-for-drawing-filled-ellipse-in-c-c
+            # Scanline fill using integer arithmetic: relative to the
+            # middle a pixel is inside if x²h² + y²w² <= w²h² (where w
+            # and h are the half-width and half-height); the span of
+            # inside pixels only narrows going out from the middle row
+            # so each span's half-width is found by stepping x down from
+            # the previous one
             halfWidth = width // 2
             halfHeight = height // 2
             midX = x0 + halfWidth
             midY = y0 + halfHeight
-            for y in range(-halfHeight, halfHeight + 1):
-                for x in range(-halfWidth, halfWidth + 1):
-                    dx =  x / halfWidth
-                    dy =  y / halfHeight
-                    if ((dx * dx) + (dy * dy)) <= 1:
-                        self.set_pixel(<int>round(midX + x),
-                                       <int>round(midY + y), fill)
+            w2 = <long long>halfWidth * halfWidth
+            h2 = <long long>halfHeight * halfHeight
+            limit = w2 * h2
+            x = halfWidth
+            for y in range(halfHeight + 1):
+                while ((<long long>x * x * h2) + (<long long>y * y * w2) >
+                        limit):
+                    x -= 1
+                self._fill_span(midY + y, midX - x, midX + x, fill)
+                if y:
+                    self._fill_span(midY - y, midX - x, midX + x, fill)
         if outline is not None:
             # Midpoint ellipse algorithm from "Computer Graphics
             # Principles and Practice".
@@ -250,6 +258,12 @@ class Image:
                 ellipse_point(dx, dy)
 
 
+    def _fill_span(self, int y, int x0, int x1, _DTYPE_t color):
+        # Fills row y from x0 to x1 inclusive with a slice assignment
+        cdef int offset = y * self.width
+        self.pixels[offset + x0:offset + x1 + 1] = color
+
+
     def subsample(self, int stride):
         """returns a subsampled copy of this image.
         
@@ -262,20 +276,12 @@ class Image:
         """
         assert (2 <= stride <= min(self.width // 2, self.height // 2) and
                 isinstance(stride, int))
-        cdef _DTYPE_t[:] pixels = create_array(self.width // stride,
-                self.height // stride)
-        cdef int offset
-        cdef int index = 0
-        cdef int height = self.height - (self.height % stride)
-        cdef int width = self.width - (self.width % stride)
-        for y in range(0, height, stride):
-            offset = y * self.width
-            for x in range(0, width, stride):
-                if index == len(pixels):
-                    break
-                pixels[index] = self.pixels[offset + x]
-                index += 1
-        return self.from_data(self.width // stride, pixels)
+        cdef int columns = self.width // stride
+        cdef int rows = self.height // stride
+        pixels = numpy.ascontiguousarray(numpy.asarray(self.pixels).reshape(
+                self.height, self.width)[:rows * stride:stride,
+                :columns * stride:stride]).reshape(-1)
+        return self.from_data(columns, pixels)
 
 
     def scale(self, double ratio):
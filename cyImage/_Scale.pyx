@@ -13,31 +13,37 @@
 # Throughout, pixels and newPixels are really of type
 # numpy.ndarray[_DTYPE_t] but using a memory view is almost 4x faster
 
-from libc.math cimport round # Use C rather than Python round()
+from libc.math cimport rint, round # Use C rather than Python round()
+from libc.stdlib cimport abort, free, malloc
 import numpy
 cimport numpy
 cimport cython
+from cython.parallel cimport parallel, prange
 
 
 _DTYPE = numpy.uint32 # See: http://docs.cython.org/src/tutorial/numpy.html
 ctypedef numpy.uint32_t _DTYPE_t
 
-cdef struct Argb:
-    int alpha
-    int red
-    int green
-    int blue
-
 DEF MAX_COMPONENT = 0xFF
+DEF CHANNELS = 4 # α, r, g, b
 
 
 @cython.boundscheck(False)
-def scale(_DTYPE_t[:] pixels, int width, int height, double ratio):
+@cython.wraparound(False)
+def scale(_DTYPE_t[:] pixels, int width, int height, double ratio,
+        bint roundMeans=False):
     """returns a smoothly scaled copy of this image
 
     ratio is how much to scale by, e.g., 0.75 means reduce width and
     height to ¾ their original size, 0.5 to half (making the image ¼
     of the original size), and so on.
+
+    The columns' box boundaries are computed once, and the output rows
+    are computed in parallel (without the GIL) by as many threads as
+    OpenMP provides.
+
+    Each box's mean is truncated, or if roundMeans is True rounded with
+    halves to even, as Image's numpy and pure Python scalers do.
     """
     assert 0 < ratio < 1
     cdef int rows = <int>round(height * ratio)
@@ -45,58 +51,83 @@ def scale(_DTYPE_t[:] pixels, int width, int height, double ratio):
     cdef _DTYPE_t[:] newPixels = numpy.zeros(rows * columns, dtype=_DTYPE)
     cdef double yStep = height / rows
     cdef double xStep = width / columns
-    cdef int index = 0
-    cdef int row, column, y0, y1, x0, x1
-    for row in range(rows):
-        y0 = <int>round(row * yStep)
-        y1 = <int>round(y0 + yStep)
-        for column in range(columns):
-            x0 = <int>round(column * xStep)
-            x1 = <int>round(x0 + xStep)
-            newPixels[index] = _mean(pixels, width, height, x0, y0, x1, y1)
-            index += 1
+    cdef int[:] x0s = numpy.empty(columns, dtype=numpy.intc)
+    cdef int[:] x1s = numpy.empty(columns, dtype=numpy.intc)
+    cdef int row, column
+    for column in range(columns):
+        x0s[column] = <int>round(column * xStep)
+        x1s[column] = min(<int>round(x0s[column] + xStep), width)
+    cdef long long *sums
+    cdef long long *totals
+    with nogil, parallel():
+        # Each thread has its own row sums and box totals
+        sums = <long long *>malloc((width + 1) * CHANNELS *
+                sizeof(long long))
+        totals = <long long *>malloc(columns * CHANNELS * sizeof(long long))
+        if sums == NULL or totals == NULL:
+            abort()
+        for row in prange(rows, schedule="static"):
+            _scale_row(pixels, width, height, yStep, x0s, x1s, columns, row,
+                    roundMeans, sums, totals, newPixels)
+        free(sums)
+        free(totals)
     return columns, newPixels
 
 
-@cython.cdivision(True)
 @cython.boundscheck(False)
-cdef _DTYPE_t _mean(_DTYPE_t[:] pixels, int width, int height, int x0,
-        int y0, int x1, int y1):
-    cdef int alphaTotal = 0
-    cdef int redTotal = 0
-    cdef int greenTotal = 0
-    cdef int blueTotal = 0
-    cdef int count = 0
-    cdef int y, x, offset
-    cdef Argb argb
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _scale_row(_DTYPE_t[:] pixels, int width, int height,
+        double yStep, int[:] x0s, int[:] x1s, int columns, int row,
+        bint roundMeans, long long *sums, long long *totals,
+        _DTYPE_t[:] newPixels) noexcept nogil:
+    # Each source row in the output row's band is read once to compute
+    # per-channel running sums from which every box's row total is the
+    # difference of two sums
+    cdef int y0 = <int>round(row * yStep)
+    cdef int y1 = min(<int>round(y0 + yStep), height)
+    cdef int x, y, column, channel, offset, count
+    cdef int means[CHANNELS]
+    cdef long long total
+    cdef _DTYPE_t color
+    for column in range(columns * CHANNELS):
+        totals[column] = 0
+    for channel in range(CHANNELS):
+        sums[channel] = 0
     for y in range(y0, y1):
-        if y >= height:
-            break
-        offset = y * width # Compute this per row rather than per pixel
-        for x in range(x0, x1):
-            if x >= width:
-                break
-            argb = _argb_for_color(pixels[offset + x])
-            alphaTotal += argb.alpha
-            redTotal += argb.red
-            greenTotal += argb.green
-            blueTotal += argb.blue
-            count += 1
-    cdef int a = <int>round(alphaTotal / count)
-    cdef int r = <int>round(redTotal / count)
-    cdef int g = <int>round(greenTotal / count)
-    cdef int b = <int>round(blueTotal / count)
-    return _color_for_argb(a, r, g, b)
-
-
-cdef inline Argb _argb_for_color(_DTYPE_t color):
-    """returns an ARGB quadruple for a color specified as a numpy.uint32"""
-    return Argb((color >> 24) & MAX_COMPONENT,
-            (color >> 16) & MAX_COMPONENT, (color >> 8) & MAX_COMPONENT,
-            (color & MAX_COMPONENT))
+        offset = y * width
+        for x in range(width):
+            color = pixels[offset + x]
+            sums[(x + 1) * CHANNELS] = (sums[x * CHANNELS] +
+                    ((color >> 24) & MAX_COMPONENT))
+            sums[((x + 1) * CHANNELS) + 1] = (sums[(x * CHANNELS) + 1] +
+                    ((color >> 16) & MAX_COMPONENT))
+            sums[((x + 1) * CHANNELS) + 2] = (sums[(x * CHANNELS) + 2] +
+                    ((color >> 8) & MAX_COMPONENT))
+            sums[((x + 1) * CHANNELS) + 3] = (sums[(x * CHANNELS) + 3] +
+                    (color & MAX_COMPONENT))
+        for column in range(columns):
+            for channel in range(CHANNELS):
+                totals[(column * CHANNELS) + channel] += (
+                        sums[(x1s[column] * CHANNELS) + channel] -
+                        sums[(x0s[column] * CHANNELS) + channel])
+    for column in range(columns):
+        # With cdivision the totals are divided as C ints as they always
+        # have been, unless roundMeans, in which case they're divided as
+        # doubles and rint() rounds halves to even like numpy.rint()
+        count = (y1 - y0) * (x1s[column] - x0s[column])
+        for channel in range(CHANNELS):
+            total = totals[(column * CHANNELS) + channel]
+            if roundMeans:
+                means[channel] = <int>rint(<double>total / count)
+            else:
+                means[channel] = <int>round(total / count)
+        newPixels[(row * columns) + column] = _color_for_argb(means[0],
+                means[1], means[2], means[3])
 
 
-cdef inline _DTYPE_t _color_for_argb(int a, int r, int g, int b):
+cdef inline _DTYPE_t _color_for_argb(int a, int r, int g,
+        int b) noexcept nogil:
     """returns a numpy.uint32 representing the given ARGB values"""
     return (((a & MAX_COMPONENT) << 24) | ((r & MAX_COMPONENT) << 16) |
             ((g & MAX_COMPONENT) << 8) | (b & MAX_COMPONENT))
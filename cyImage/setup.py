@@ -16,6 +16,13 @@ import numpy
 import Cython.Build
 
 
+# scale() uses OpenMP threads (use "/openmp" for both with MSVC)
+extensions = Cython.Build.cythonize("*.pyx")
+for extension in extensions:
+    extension.extra_compile_args.append("-fopenmp")
+    extension.extra_link_args.append("-fopenmp")
+
+
 distutils.core.setup(name="cyImage",
         include_dirs=[numpy.get_include()],
-        ext_modules=Cython.Build.cythonize("*.pyx"))
+        ext_modules=extensions)
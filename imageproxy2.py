@@ -11,10 +11,7 @@
 
 import os
 import tempfile
-try:
-    import cyImage as Image
-except ImportError:
-    import Image
+import Image
 
 
 YELLOW, CYAN, BLUE, RED, BLACK = (Image.color_for_name(color)
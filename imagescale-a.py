@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import sys
+if sys.version_info < (3, 7):
+    print("requires Python 3.7+ for asyncio.run()")
+    sys.exit(1)
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import Ladder
+import Manifest
+import Qtrac
+
+
+Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
+PREFETCH_SIZE = 1 << 20
+
+
+def main():
+    (rungs, smooth, colors, dither, source, target, concurrency, window,
+            recursive, force) = handle_commandline()
+    Qtrac.report("starting...")
+    sizes = [size for size, _ in rungs]
+    # A single size is recorded as before so that old manifests are valid
+    manifest = Manifest.Manifest(target, dict(size=sizes if len(sizes) > 1
+            else sizes[0], smooth=smooth, colors=colors, dither=dither),
+            force)
+    try:
+        summary = asyncio.run(scale(rungs, smooth, colors, dither, source,
+                target, concurrency, window, recursive, manifest))
+    finally:
+        manifest.save()
+    summarize(summary, concurrency, manifest.current)
+
+
+def handle_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int,
+            default=multiprocessing.cpu_count(),
+            help="specify the concurrency (for debugging and "
+                "timing) [default: %(default)d]")
+    sizeGroup = parser.add_mutually_exclusive_group()
+    sizeGroup.add_argument("-s", "--size", default=400, type=int,
+            help="make a scaled image that fits the given dimension "
+                "[default: %(default)d]")
+    sizeGroup.add_argument("--sizes",
+            help="make a scaled image for each of these comma-separated "
+                "dimensions, decoding each original only once, e.g., "
+                "1600,800,400,128; a size may be followed by :PATTERN "
+                "to name its images (see --name)")
+    parser.add_argument("-n", "--name", default=Ladder.PATTERN,
+            help="the name pattern for --sizes images, using {name}, "
+                "{stem}, {ext}, and {size} [default: %(default)s]")
+    parser.add_argument("-S", "--smooth", action="store_true",
+            help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-w", "--window", type=int,
+            help="the most images to be reading or scaling at any one "
+                "time; more than the concurrency keeps the processes "
+                "busy when reading is slow [default: 4 x concurrency]")
+    parser.add_argument("-r", "--recursive", action="store_true",
+            help="scale the images in the source's subdirectories too, "
+                "putting them in the same subdirectories of the target")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
+    parser.add_argument("source",
+            help="the directory containing the original .xpm images")
+    parser.add_argument("target",
+            help="the directory for the scaled .xpm images")
+    args = parser.parse_args()
+    source = os.path.abspath(args.source)
+    target = os.path.abspath(args.target)
+    if source == target:
+        parser.error("source and target must be different")
+    if args.window is None:
+        args.window = 4 * args.concurrency
+    if args.concurrency < 1 or args.window < 1:
+        parser.error("the concurrency and window must be at least 1")
+    if args.sizes is None:
+        rungs = [(args.size, "{name}")]
+    else:
+        try:
+            rungs = Ladder.parse_sizes(args.sizes, args.name)
+        except ValueError as err:
+            parser.error(str(err))
+    if not os.path.exists(args.target):
+        os.makedirs(target)
+    return (rungs, args.smooth, args.colors, args.dither, source, target,
+            args.concurrency, args.window, args.recursive, args.force)
+
+
+async def scale(rungs, smooth, colors, dither, source, target,
+        concurrency, window, recursive, manifest):
+    # The scanner finds the jobs and puts them in a queue that holds at
+    # most window of them, so it waits rather than getting far ahead;
+    # each of window workers reads a job's original in a thread and then
+    # scales it in a process, so slow reads overlap other images' scaling
+    # and memory use doesn't depend on the number of images
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT,
+                asyncio.current_task().cancel)
+    except NotImplementedError: # Windows
+        pass
+    canceled = False
+    counts = collections.Counter()
+    jobs = asyncio.Queue(window)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=concurrency,
+            initializer=ignore_interrupts) as executor:
+        tasks = [asyncio.ensure_future(scan(source, target, rungs,
+                recursive, manifest, jobs, window, counts))]
+        tasks += [asyncio.ensure_future(work(smooth, colors, dither,
+                  executor, manifest, jobs, counts)) for _ in range(window)]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            Qtrac.report("canceling...")
+            canceled = True
+        finally:
+            for task in tasks: # Cancels the jobs that haven't started
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return Summary(counts["todo"], counts["copied"], counts["scaled"],
+            canceled)
+
+
+def ignore_interrupts():
+    # Lets the event loop handle Ctrl+C by canceling, so that the
+    # processes finish their images rather than dying mid-write
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+async def scan(source, target, rungs, recursive, manifest, jobs, window,
+        counts):
+    # Each job is a source and its (size, targetImage) pairs, with None
+    # for targets that are current (but may be needed for smaller ones);
+    # listing and checking are done in threads since they may be slow
+    loop = asyncio.get_running_loop()
+    directories = [source]
+    while directories:
+        directory = directories.pop()
+        for path, isDirectory in await loop.run_in_executor(None,
+                entries_for, directory):
+            if isDirectory:
+                if recursive and path != target:
+                    directories.append(path)
+                continue
+            targets = await loop.run_in_executor(None, targets_for, path,
+                    source, target, rungs, manifest)
+            count = sum(targetImage is not None for _, targetImage in
+                        targets)
+            if count:
+                counts["todo"] += count
+                await jobs.put((path, targets))
+    for _ in range(window):
+        await jobs.put(None) # Tells a worker there are no more jobs
+
+
+def entries_for(directory):
+    with os.scandir(directory) as entries:
+        return sorted((entry.path, entry.is_dir()) for entry in entries)
+
+
+def targets_for(sourceImage, source, target, rungs, manifest):
+    name = os.path.relpath(sourceImage, source)
+    targets = []
+    for size, pattern in rungs:
+        targetImage = Ladder.target_for(target, name, size, pattern)
+        if manifest.is_current(sourceImage, targetImage):
+            targetImage = None
+        targets.append((size, targetImage))
+    return targets
+
+
+async def work(smooth, colors, dither, executor, manifest, jobs, counts):
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await jobs.get()
+        if job is None:
+            break
+        sourceImage, targets = job
+        await loop.run_in_executor(None, prefetch, sourceImage)
+        try:
+            results = await loop.run_in_executor(executor, Ladder.scale,
+                    sourceImage, targets, smooth, colors, dither)
+        except Exception as err: # Report it and carry on with the rest
+            Qtrac.report(str(err), True)
+            continue
+        for result in results:
+            await loop.run_in_executor(None, manifest.record, result.name)
+            counts["copied"] += result.copied
+            counts["scaled"] += result.scaled
+            Qtrac.report("{} {}".format("copied" if result.copied else
+                    "scaled", os.path.basename(result.name)))
+
+
+def prefetch(filename):
+    # Reads the file so that it's in the operating system's cache by the
+    # time a process decodes it
+    buffer = bytearray(PREFETCH_SIZE)
+    try:
+        with open(filename, "rb", buffering=0) as file:
+            while file.readinto(buffer):
+                pass
+    except OSError:
+        pass # Reported when the process tries to read it
+
+
+def summarize(summary, concurrency, unchanged):
+    message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
+    difference = summary.todo - (summary.copied + summary.scaled)
+    if difference:
+        message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
+    message += "using {} processes".format(concurrency)
+    if summary.canceled:
+        message += " [canceled]"
+    Qtrac.report(message)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,10 @@ import collections
 import math
 import multiprocessing
 import os
+import shutil
 import sys
 import Image
+import Manifest
 import Qtrac
 
 
@@ -23,15 +25,21 @@ Result = collections.namedtuple("Result", "todo copied scaled name")
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    (size, smooth, colors, dither, source, target, concurrency,
+            force) = handle_commandline()
     Qtrac.report("starting...")
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=smooth,
+            colors=colors, dither=dither), force)
     canceled = False
     try:
-        scale(size, smooth, source, target, concurrency)
+        scale(size, smooth, colors, dither, source, target,
+                concurrency, manifest)
     except KeyboardInterrupt:
         Qtrac.report("canceling...")
         canceled = True
-    summarize(concurrency, canceled)
+    finally:
+        manifest.save()
+    summarize(concurrency, canceled, manifest.current)
 
 
 def handle_commandline():
@@ -45,6 +53,14 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -56,36 +72,43 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
+    return (args.size, args.smooth, args.colors, args.dither,
+            source, target, args.concurrency, args.force)
 
 
-def scale(size, smooth, source, target, concurrency):
-    pipeline = create_pipeline(size, smooth, concurrency)
+def scale(size, smooth, colors, dither, source, target, concurrency,
+        manifest):
+    pipeline = create_pipeline(size, smooth, colors, dither, concurrency,
+            manifest)
     for i, (sourceImage, targetImage) in enumerate(
-            get_jobs(source, target)):
+            get_jobs(source, target, manifest)):
         pipeline.send((sourceImage, targetImage, i % concurrency))
 
 
-def create_pipeline(size, smooth, concurrency):
+def create_pipeline(size, smooth, colors, dither, concurrency, manifest):
     pipeline = None
-    sink = results()
+    sink = results(manifest)
     for who in range(concurrency):
-        pipeline = scaler(pipeline, sink, size, smooth, who)
+        pipeline = scaler(pipeline, sink, size, smooth, colors, dither, who)
     return pipeline
 
 
-def get_jobs(source, target):
+def get_jobs(source, target, manifest):
     for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            yield sourceImage, targetImage
 
 
 @Qtrac.coroutine
-def scaler(receiver, sink, size, smooth, me):
+def scaler(receiver, sink, size, smooth, colors, dither, me):
     while True:
         sourceImage, targetImage, who = (yield)
         if who == me:
             try:
-                result = scale_one(size, smooth, sourceImage, targetImage)
+                result = scale_one(size, smooth, colors, dither,
+                        sourceImage, targetImage)
                 sink.send(result)
             except Image.Error as err:
                 Qtrac.report(str(err), True)
@@ -94,9 +117,10 @@ def scaler(receiver, sink, size, smooth, me):
 
 
 @Qtrac.coroutine
-def results():
+def results(manifest):
     while True:
         result = (yield)
+        manifest.record(result.name)
         results.todo += result.todo
         results.copied += result.copied
         results.scaled += result.scaled
@@ -105,10 +129,13 @@ def results():
 results.todo = results.copied = results.scaled = 0
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
+def scale_one(size, smooth, colors, dither, sourceImage, targetImage):
+    oldImage = Image.open_header(sourceImage)
     if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
+        if colors is None: # No need to decode the pixels
+            shutil.copyfile(sourceImage, targetImage)
+        else:
+            oldImage.save(targetImage, colors, dither)
         return Result(1, 1, 0, targetImage)
     else:
         if smooth:
@@ -118,15 +145,17 @@ def scale_one(size, smooth, sourceImage, targetImage):
             stride = int(math.ceil(max(oldImage.width / size,
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
-        newImage.save(targetImage)
+        newImage.save(targetImage, colors, dither)
         return Result(1, 0, 1, targetImage)
 
 
-def summarize(concurrency, canceled):
+def summarize(concurrency, canceled, unchanged):
     message = "copied {} scaled {} ".format(results.copied, results.scaled)
     difference = results.todo - (results.copied + results.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
     message += "using {} coroutines".format(concurrency)
     if canceled:
         message += " [canceled]"
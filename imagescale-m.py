@@ -16,22 +16,33 @@ if sys.version_info < (3, 2):
 import argparse
 import collections
 import concurrent.futures
-import math
+import itertools
 import multiprocessing
 import os
 import Image
+import Ladder
+import Manifest
 import Qtrac
 
 
-Result = collections.namedtuple("Result", "copied scaled name")
 Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    (rungs, smooth, colors, dither, source, target, concurrency, window,
+            batch, force) = handle_commandline()
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target, concurrency)
-    summarize(summary, concurrency)
+    sizes = [size for size, _ in rungs]
+    # A single size is recorded as before so that old manifests are valid
+    manifest = Manifest.Manifest(target, dict(size=sizes if len(sizes) > 1
+            else sizes[0], smooth=smooth, colors=colors, dither=dither),
+            force)
+    try:
+        summary = scale(rungs, smooth, colors, dither, source, target,
+                concurrency, window, batch, manifest)
+    finally:
+        manifest.save()
+    summarize(summary, concurrency, manifest.current)
 
 
 def handle_commandline():
@@ -40,11 +51,34 @@ def handle_commandline():
             default=multiprocessing.cpu_count(),
             help="specify the concurrency (for debugging and "
                 "timing) [default: %(default)d]")
-    parser.add_argument("-s", "--size", default=400, type=int,
+    sizeGroup = parser.add_mutually_exclusive_group()
+    sizeGroup.add_argument("-s", "--size", default=400, type=int,
             help="make a scaled image that fits the given dimension "
                 "[default: %(default)d]")
+    sizeGroup.add_argument("--sizes",
+            help="make a scaled image for each of these comma-separated "
+                "dimensions, decoding each original only once, e.g., "
+                "1600,800,400,128; a size may be followed by :PATTERN "
+                "to name its images (see --name)")
+    parser.add_argument("-n", "--name", default=Ladder.PATTERN,
+            help="the name pattern for --sizes images, using {name}, "
+                "{stem}, {ext}, and {size} [default: %(default)s]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-w", "--window", type=int,
+            help="the most tasks to have submitted but not finished at "
+                "any one time [default: 4 x concurrency]")
+    parser.add_argument("-b", "--batch", default=1, type=int,
+            help="the number of images per task (more is faster for "
+                "lots of small images) [default: %(default)d]")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -54,78 +88,114 @@ def handle_commandline():
     target = os.path.abspath(args.target)
     if source == target:
         args.error("source and target must be different")
+    if args.window is None:
+        args.window = 4 * args.concurrency
+    if args.window < 1 or args.batch < 1:
+        parser.error("the window and batch must be at least 1")
+    if args.sizes is None:
+        rungs = [(args.size, "{name}")]
+    else:
+        try:
+            rungs = Ladder.parse_sizes(args.sizes, args.name)
+        except ValueError as err:
+            parser.error(str(err))
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
+    return (rungs, args.smooth, args.colors, args.dither,
+            source, target, args.concurrency, args.window, args.batch,
+            args.force)
 
 
-def scale(size, smooth, source, target, concurrency):
+def scale(rungs, smooth, colors, dither, source, target, concurrency,
+        window, batch, manifest):
+    # At most window tasks are in flight at any one time, and more are
+    # only submitted as they finish, so memory use doesn't depend on the
+    # number of images and results are reported from the start
+    canceled = False
+    todo = copied = scaled = 0
     futures = set()
+    batches = get_batches(get_jobs(source, target, rungs, manifest), batch)
     with concurrent.futures.ProcessPoolExecutor(
             max_workers=concurrency) as executor:
-        for sourceImage, targetImage in get_jobs(source, target):
-            future = executor.submit(scale_one, size, smooth, sourceImage,
-                    targetImage)
-            futures.add(future)
-        summary = wait_for(futures)
-        if summary.canceled:
+        try:
+            while True:
+                for jobs in itertools.islice(batches,
+                        window - len(futures)):
+                    futures.add(executor.submit(scale_some, smooth, colors,
+                            dither, jobs))
+                    todo += sum(targetImage is not None for _, targets in
+                                jobs for _, targetImage in targets)
+                if not futures:
+                    break
+                done, futures = concurrent.futures.wait(futures,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for result in results_for(done):
+                    manifest.record(result.name)
+                    copied += result.copied
+                    scaled += result.scaled
+                    Qtrac.report("{} {}".format("copied" if result.copied
+                            else "scaled", os.path.basename(result.name)))
+        except KeyboardInterrupt:
+            Qtrac.report("canceling...")
+            canceled = True
+            for future in futures:
+                future.cancel()
             executor.shutdown()
-        return summary
-# if we caught the KeyboardInterrupt in this function we'd lose the
-# accumulated todo, copied, scaled counts.
+    return Summary(todo, copied, scaled, canceled)
 
 
-def get_jobs(source, target):
+def get_jobs(source, target, rungs, manifest):
+    # Each job is a source and its (size, targetImage) pairs, with None
+    # for targets that are current (but may be needed for smaller ones)
     for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+        sourceImage = os.path.join(source, name)
+        targets = []
+        for size, pattern in rungs:
+            targetImage = Ladder.target_for(target, name, size, pattern)
+            if manifest.is_current(sourceImage, targetImage):
+                targetImage = None
+            targets.append((size, targetImage))
+        if any(targetImage is not None for _, targetImage in targets):
+            yield sourceImage, targets
+
+
+def get_batches(jobs, batch):
+    jobs = iter(jobs)
+    return iter(lambda: list(itertools.islice(jobs, batch)), [])
+
+
+def results_for(futures):
+    # Each future's result is a list of results and Image.Errors
+    for future in futures:
+        err = future.exception()
+        if err is not None:
+            raise err # Unanticipated
+        for result in future.result():
+            if isinstance(result, Image.Error):
+                Qtrac.report(str(result), True)
+            else:
+                yield result
 
 
-def wait_for(futures):
-    canceled = False
-    copied = scaled = 0
-    try:
-        for future in concurrent.futures.as_completed(futures):
-            err = future.exception()
-            if err is None:
-                result = future.result()
-                copied += result.copied
-                scaled += result.scaled
-                Qtrac.report("{} {}".format("copied" if result.copied else
-                        "scaled", os.path.basename(result.name)))
-            elif isinstance(err, Image.Error):
-                Qtrac.report(str(err), True)
-            else:
-                raise err # Unanticipated
-    except KeyboardInterrupt:
-        Qtrac.report("canceling...")
-        canceled = True
-        for future in futures:
-            future.cancel()
-    return Summary(len(futures), copied, scaled, canceled)
-
-
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
-    if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
-        return Result(1, 0, targetImage)
-    else:
-        if smooth:
-            scale = min(size / oldImage.width, size / oldImage.height)
-            newImage = oldImage.scale(scale)
-        else:
-            stride = int(math.ceil(max(oldImage.width / size,
-                                       oldImage.height / size)))
-            newImage = oldImage.subsample(stride)
-        newImage.save(targetImage)
-        return Result(0, 1, targetImage)
-
-
-def summarize(summary, concurrency):
+def scale_some(smooth, colors, dither, jobs):
+    # Scales a batch of images, one task rather than one per image
+    results = []
+    for sourceImage, targets in jobs:
+        try:
+            results += Ladder.scale(sourceImage, targets, smooth, colors,
+                    dither)
+        except Image.Error as err:
+            results.append(err)
+    return results
+
+
+def summarize(summary, concurrency, unchanged):
     message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
     message += "using {} processes".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
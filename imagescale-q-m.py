@@ -11,23 +11,44 @@
 
 import argparse
 import collections
+import json
 import math
 import multiprocessing
 import os
+import shutil
 import sys
+import time
 import Image
+import Manifest
 import Qtrac
 
 
-Result = collections.namedtuple("Result", "copied scaled name")
+# The times are in milliseconds, the sizes in bytes, and pixels is the
+# source image's pixel count
+Result = collections.namedtuple("Result", "copied scaled name pid pixels "
+        "bytesIn bytesOut loadMs scaleMs saveMs")
+Failure = collections.namedtuple("Failure", "name pid error")
 Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
+STAGES = ("load", "scale", "save")
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    (size, smooth, colors, dither, source, target, concurrency, force,
+            logName) = handle_commandline()
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target, concurrency)
-    summarize(summary, concurrency)
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=smooth,
+            colors=colors, dither=dither), force)
+    log = (open(logName, "wt", encoding="utf-8") if logName is not None
+           else None)
+    statistics = Statistics(log)
+    try:
+        summary = scale(size, smooth, colors, dither, source, target,
+                concurrency, manifest, statistics)
+    finally:
+        manifest.save()
+        if log is not None:
+            log.close()
+    summarize(summary, concurrency, manifest.current, statistics)
 
 
 def handle_commandline():
@@ -41,6 +62,17 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
+    parser.add_argument("-l", "--log",
+            help="write a JSON object per image (with its times, sizes, "
+                "and worker pid) to this file")
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -52,86 +84,173 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
+    return (args.size, args.smooth, args.colors, args.dither,
+            source, target, args.concurrency, args.force, args.log)
 
 
-def scale(size, smooth, source, target, concurrency):
+def scale(size, smooth, colors, dither, source, target, concurrency,
+        manifest, statistics):
+    # Every job produces one Result or Failure, so these are handled as
+    # they arrive until there's one for each job
     canceled = False
-    jobs = multiprocessing.JoinableQueue()
+    jobs = multiprocessing.Queue()
     results = multiprocessing.Queue()
-    create_processes(size, smooth, jobs, results, concurrency)
-    todo = add_jobs(source, target, jobs)
+    create_processes(size, smooth, colors, dither, jobs, results, concurrency)
+    todo = add_jobs(source, target, jobs, manifest)
+    copied = scaled = 0
     try:
-        jobs.join()
+        for _ in range(todo):
+            result = results.get()
+            statistics.add(result)
+            if isinstance(result, Failure):
+                Qtrac.report(result.error, True)
+                continue
+            manifest.record(result.name)
+            copied += result.copied
+            scaled += result.scaled
+            Qtrac.report("{:.1f} images/s {:.2f} MP/s {} {}".format(
+                    *statistics.rates(), "copied" if result.copied else
+                    "scaled", os.path.basename(result.name)))
     except KeyboardInterrupt: # May not work on Windows
         Qtrac.report("canceling...")
         canceled = True
-    copied = scaled = 0
-    while not results.empty(): # Safe because all jobs have finished
-        result = results.get_nowait()
-        copied += result.copied
-        scaled += result.scaled
     return Summary(todo, copied, scaled, canceled)
 
 
-def create_processes(size, smooth, jobs, results, concurrency):
+def create_processes(size, smooth, colors, dither, jobs, results,
+        concurrency):
     for _ in range(concurrency):
         process = multiprocessing.Process(target=worker, args=(size,
-                smooth, jobs, results))
+                smooth, colors, dither, jobs, results))
         process.daemon = True
         process.start()
 
 
-def worker(size, smooth, jobs, results):
+def worker(size, smooth, colors, dither, jobs, results):
     while True:
+        sourceImage, targetImage = jobs.get()
         try:
-            sourceImage, targetImage = jobs.get()
-            try:
-                result = scale_one(size, smooth, sourceImage, targetImage)
-                Qtrac.report("{} {}".format("copied" if result.copied else
-                        "scaled", os.path.basename(result.name)))
-                results.put(result)
-            except Image.Error as err:
-                Qtrac.report(str(err), True)
-        finally:
-            jobs.task_done()
-
-
-def add_jobs(source, target, jobs):
-    for todo, name in enumerate(os.listdir(source), start=1):
-        sourceImage = os.path.join(source, name)
-        targetImage = os.path.join(target, name)
+            results.put(scale_one(size, smooth, colors, dither,
+                    sourceImage, targetImage))
+        except Exception as err: # The parent is waiting for a record
+            results.put(Failure(targetImage, os.getpid(), str(err)))
+
+
+def add_jobs(source, target, jobs, manifest):
+    todo = 0
+    for todo, (sourceImage, targetImage) in enumerate(get_jobs(source,
+            target, manifest), start=1):
         jobs.put((sourceImage, targetImage))
     return todo
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
-    if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
-        return Result(1, 0, targetImage)
+def get_jobs(source, target, manifest):
+    for name in os.listdir(source):
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            yield sourceImage, targetImage
+
+
+def scale_one(size, smooth, colors, dither, sourceImage, targetImage):
+    # Loading includes decoding and scaling includes reducing the colors
+    start = time.perf_counter()
+    oldImage = Image.open_header(sourceImage)
+    copy = oldImage.width <= size and oldImage.height <= size
+    if copy and colors is None: # No need to decode the pixels
+        loaded = scaled = time.perf_counter()
+        shutil.copyfile(sourceImage, targetImage)
     else:
-        if smooth:
+        oldImage.load(sourceImage) # Decode now so it's timed as loading
+        loaded = time.perf_counter()
+        if copy:
+            newImage = oldImage
+        elif smooth:
             scale = min(size / oldImage.width, size / oldImage.height)
             newImage = oldImage.scale(scale)
         else:
             stride = int(math.ceil(max(oldImage.width / size,
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
+        if colors is not None:
+            newImage = newImage.quantize(colors, dither)
+        scaled = time.perf_counter()
         newImage.save(targetImage)
-        return Result(0, 1, targetImage)
+    saved = time.perf_counter()
+    return Result(int(copy), int(not copy), targetImage, os.getpid(),
+            oldImage.width * oldImage.height, os.path.getsize(sourceImage),
+            os.path.getsize(targetImage), (loaded - start) * 1000,
+            (scaled - loaded) * 1000, (saved - scaled) * 1000)
+
+
+class Statistics:
+
+    def __init__(self, log=None):
+        """aggregates Results and Failures as they arrive, writing each
+        as a line of JSON to the log file if there is one"""
+        self.log = log
+        self.start = time.perf_counter()
+        self.images = self.pixels = self.bytesIn = self.bytesOut = 0
+        self.times = collections.defaultdict(list) # stage: [ms, ...]
+        self.pids = set()
+
+
+    def add(self, result):
+        if self.log is not None:
+            record = result._asdict()
+            record["elapsed"] = round(time.perf_counter() - self.start, 6)
+            self.log.write(json.dumps(record) + "\n")
+        self.pids.add(result.pid)
+        if isinstance(result, Failure):
+            return
+        self.images += 1
+        self.pixels += result.pixels
+        self.bytesIn += result.bytesIn
+        self.bytesOut += result.bytesOut
+        total = 0
+        for stage in STAGES:
+            ms = getattr(result, stage + "Ms")
+            self.times[stage].append(ms)
+            total += ms
+        self.times["total"].append(total)
+
+
+    def rates(self):
+        """returns the images per second and megapixels per second so
+        far"""
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return self.images / elapsed, self.pixels / elapsed / 1e6
+
+
+    def report(self):
+        if not self.images:
+            return
+        imagesPerSecond, megapixelsPerSecond = self.rates()
+        print("{:.1f} images/s {:.2f} MP/s; {:,} bytes read, {:,} written "
+              "by {} workers".format(imagesPerSecond, megapixelsPerSecond,
+              self.bytesIn, self.bytesOut, len(self.pids)))
+        print("{:6} {:>9} {:>9} {:>9} {:>9}".format("ms", "p50", "p95",
+                "p99", "max"))
+        for stage in STAGES + ("total",):
+            times = self.times[stage]
+            print("{:6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(stage,
+                    Qtrac.percentile(times, 50), Qtrac.percentile(times, 95),
+                    Qtrac.percentile(times, 99), max(times)))
 
 
-def summarize(summary, concurrency):
+def summarize(summary, concurrency, unchanged, statistics):
     message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
     message += "using {} processes".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
     Qtrac.report(message)
     print()
+    statistics.report()
 
 
 if __name__ == "__main__":
@@ -13,8 +13,10 @@ import argparse
 import collections
 import math
 import os
+import shutil
 import sys
 import Image
+import Manifest
 import Qtrac
 
 Result = collections.namedtuple("Result", "copied scaled")
@@ -22,10 +24,17 @@ Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
 
 
 def main():
-    size, smooth, source, target = handle_commandline()
+    (size, smooth, colors, dither, source, target,
+            force) = handle_commandline()
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target)
-    summarize(summary)
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=smooth,
+            colors=colors, dither=dither), force)
+    try:
+        summary = scale(size, smooth, colors, dither, source, target,
+                manifest)
+    finally:
+        manifest.save()
+    summarize(summary, manifest.current)
 
 
 def handle_commandline():
@@ -35,6 +44,14 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -46,16 +63,19 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target
+    return (args.size, args.smooth, args.colors, args.dither,
+            source, target, args.force)
 
 
-def scale(size, smooth, source, target):
+def scale(size, smooth, colors, dither, source, target, manifest):
     canceled = False
     todo = copied = scaled = 0
-    for sourceImage, targetImage in get_jobs(source, target):
+    for sourceImage, targetImage in get_jobs(source, target, manifest):
         try:
             todo += 1
-            result = scale_one(size, smooth, sourceImage, targetImage)
+            result = scale_one(size, smooth, colors, dither,
+                    sourceImage, targetImage)
+            manifest.record(targetImage)
             copied += result.copied
             scaled += result.scaled
             Qtrac.report("{} {}".format("copied" if result.copied
@@ -69,15 +89,21 @@ def scale(size, smooth, source, target):
     return Summary(todo, copied, scaled, canceled)
 
 
-def get_jobs(source, target):
+def get_jobs(source, target, manifest):
     for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            yield sourceImage, targetImage
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
+def scale_one(size, smooth, colors, dither, sourceImage, targetImage):
+    oldImage = Image.open_header(sourceImage)
     if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
+        if colors is None: # No need to decode the pixels
+            shutil.copyfile(sourceImage, targetImage)
+        else:
+            oldImage.save(targetImage, colors, dither)
         return Result(1, 0)
     else:
         if smooth:
@@ -87,15 +113,17 @@ def scale_one(size, smooth, sourceImage, targetImage):
             stride = int(math.ceil(max(oldImage.width / size,
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
-        newImage.save(targetImage)
+        newImage.save(targetImage, colors, dither)
         return Result(0, 1)
 
 
-def summarize(summary):
+def summarize(summary, unchanged):
     message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
     message += "single-threaded"
     if summary.canceled:
         message += " [canceled]"
@@ -19,7 +19,9 @@ import concurrent.futures
 import math
 import multiprocessing
 import os
+import shutil
 import Image
+import Manifest
 import Qtrac
 
 
@@ -28,10 +30,17 @@ Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    (size, smooth, colors, dither, source, target, concurrency,
+            force) = handle_commandline()
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target, concurrency)
-    summarize(summary, concurrency)
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=smooth,
+            colors=colors, dither=dither), force)
+    try:
+        summary = scale(size, smooth, colors, dither, source, target,
+                concurrency, manifest)
+    finally:
+        manifest.save()
+    summarize(summary, concurrency, manifest.current)
 
 
 def handle_commandline():
@@ -45,6 +54,14 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-C", "--colors", type=int,
+            help="save the images with at most this many colors (much "
+                "smaller .xpm files for photographs)")
+    parser.add_argument("-D", "--dither", action="store_true",
+            help="dither when reducing the colors (see --colors)")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="redo every image, even those that are unchanged since "
+                "the last run")
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -56,17 +73,20 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
+    return (args.size, args.smooth, args.colors, args.dither,
+            source, target, args.concurrency, args.force)
 
 
-def scale(size, smooth, source, target, concurrency):
+def scale(size, smooth, colors, dither, source, target, concurrency,
+        manifest):
     futures = set()
     with concurrent.futures.ThreadPoolExecutor(
             max_workers=concurrency) as executor:
-        for sourceImage, targetImage in get_jobs(source, target):
-            futures.add(executor.submit(scale_one, size, smooth,
-                    sourceImage, targetImage))
-        summary = wait_for(futures)
+        for sourceImage, targetImage in get_jobs(source, target,
+                manifest):
+            futures.add(executor.submit(scale_one, size, smooth, colors,
+                    dither, sourceImage, targetImage))
+        summary = wait_for(futures, manifest)
         if summary.canceled:
             executor.shutdown()
         return summary
@@ -74,12 +94,15 @@ def scale(size, smooth, source, target, concurrency):
 # accumulated todo, copied, scaled counts.
 
 
-def get_jobs(source, target):
+def get_jobs(source, target, manifest):
     for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            yield sourceImage, targetImage
 
 
-def wait_for(futures):
+def wait_for(futures, manifest):
     canceled = False
     copied = scaled = 0
     try:
@@ -87,6 +110,7 @@ def wait_for(futures):
             err = future.exception()
             if err is None:
                 result = future.result()
+                manifest.record(result.name)
                 copied += result.copied
                 scaled += result.scaled
                 Qtrac.report("{} {}".format("copied" if result.copied else
@@ -103,10 +127,13 @@ def wait_for(futures):
     return Summary(len(futures), copied, scaled, canceled)
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
+def scale_one(size, smooth, colors, dither, sourceImage, targetImage):
+    oldImage = Image.open_header(sourceImage)
     if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
+        if colors is None: # No need to decode the pixels
+            shutil.copyfile(sourceImage, targetImage)
+        else:
+            oldImage.save(targetImage, colors, dither)
         return Result(1, 0, targetImage)
     else:
         if smooth:
@@ -116,15 +143,17 @@ def scale_one(size, smooth, sourceImage, targetImage):
             stride = int(math.ceil(max(oldImage.width / size,
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
-        newImage.save(targetImage)
+        newImage.save(targetImage, colors, dither)
         return Result(0, 1, targetImage)
 
 
-def summarize(summary, concurrency):
+def summarize(summary, concurrency, unchanged):
     message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if unchanged:
+        message += "unchanged {} ".format(unchanged)
     message += "using {} threads".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
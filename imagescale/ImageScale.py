@@ -13,13 +13,12 @@ import collections
 import concurrent.futures
 import multiprocessing
 import os
+import shutil
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
         ".."))) # For access to parallel Image
-try:
-    import cyImage as Image
-except ImportError:
-    import Image
+import Image
+import Manifest
 from Globals import *
 
 
@@ -28,9 +27,18 @@ Result = collections.namedtuple("Result", "name copied scaled")
 
 def scale(size, source, target, report_progress, state, when_finished):
     futures = set()
+    # The parameters match the imagescale-*.py programs' with --smooth
+    manifest = Manifest.Manifest(target, dict(size=size, smooth=True,
+            colors=None, dither=False))
+    concurrency = multiprocessing.cpu_count()
+    window = 4 * concurrency # Most futures to have unfinished at once
     with concurrent.futures.ProcessPoolExecutor(
-            max_workers=multiprocessing.cpu_count()) as executor:
-        for sourceImage, targetImage in get_jobs(source, target):
+            max_workers=concurrency) as executor:
+        for sourceImage, targetImage in get_jobs(source, target, manifest):
+            if len(futures) >= window:
+                done, futures = concurrent.futures.wait(futures,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                record(done, manifest)
             future = executor.submit(scale_one, size, sourceImage,
                     targetImage, state)
             future.add_done_callback(report_progress)
@@ -41,23 +49,34 @@ def scale(size, source, target, report_progress, state, when_finished):
                 executor.shutdown()
                 break
         concurrent.futures.wait(futures) # Keep working until finished
+    record(futures, manifest)
+    manifest.save()
     if state.value != TERMINATING:
         when_finished()
 
 
-def get_jobs(source, target):
+def record(futures, manifest):
+    for future in futures:
+        if not future.cancelled() and future.exception() is None:
+            manifest.record(future.result().name)
+
+
+def get_jobs(source, target, manifest):
     for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if not manifest.is_current(sourceImage, targetImage):
+            yield sourceImage, targetImage
 
 
 def scale_one(size, sourceImage, targetImage, state):
     if state.value in {CANCELED, TERMINATING}:
         raise Canceled()
-    oldImage = Image.Image.from_file(sourceImage)
+    oldImage = Image.Image.open_header(sourceImage)
     if state.value in {CANCELED, TERMINATING}:
         raise Canceled()
     if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
+        shutil.copyfile(sourceImage, targetImage) # No need to decode
         return Result(targetImage, 1, 0)
     else:
         scale = min(size / oldImage.width, size / oldImage.height)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import os
+import random
+import pytest
+import Image
+
+
+# Sizes and ratios for which every backend (including Cython, which only
+# handles ratios whose boxes it rounds the same way) serves the call
+SCALINGS = ((64, 48, 0.5), (64, 48, 0.25), (61, 47, 0.3), (50, 40, 0.7))
+
+
+@pytest.fixture
+def preferences():
+    yield
+    Image.prefer_backends(os.environ.get("IMAGE_BACKENDS", ""))
+
+
+def random_image(width, height, seed=1):
+    rand = random.Random(seed)
+    image = Image.create(width, height)
+    for y in range(height):
+        for x in range(width):
+            image.set_pixel(x, y, rand.getrandbits(32))
+    return image
+
+
+def test_scale_backends_agree(preferences):
+    served = set()
+    for width, height, ratio in SCALINGS:
+        image = random_image(width, height)
+        expected = None
+        for name in Image.backends("scale"):
+            Image.prefer_backends("scale=" + name)
+            scaled = image.scale(ratio)
+            if Image.last_backend("scale") != name:
+                continue # Declined
+            served.add(name)
+            result = (scaled.width, scaled.height, list(scaled.pixels))
+            if expected is None:
+                expected = result
+            assert result == expected, (name, width, height, ratio)
+        Image.prefer_backends("")
+        scaled = image.scale(ratio, workers=2)
+        assert (scaled.width, scaled.height, list(scaled.pixels)) == (
+                expected)
+    assert served == set(Image.backends("scale"))
+
+
+def test_scale_rows_matches_scale(preferences):
+    for width, height, ratio in SCALINGS:
+        image = random_image(width, height)
+        rows = [image.pixels[y * width:(y + 1) * width]
+                for y in range(height)]
+        for name in Image.backends("scale"):
+            Image.prefer_backends("scale=" + name)
+            scaled = image.scale(ratio)
+            streamed = []
+            for row in Image.scale_rows(iter(rows), width, height, ratio):
+                assert len(row) == scaled.width
+                streamed += list(row)
+            assert streamed == list(scaled.pixels), (name, width, height,
+                                                     ratio)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import os
+import pytest
+import Image
+import Ladder
+
+
+SIZES = "1600,800,400,128"
+
+
+@pytest.mark.parametrize("smooth", [False, True])
+# Scaling 136x400 (the 400 rung) by 128 / 400 would give 44x128 rather
+# than the 43x128 that scaling the 200x590 original gives
+@pytest.mark.parametrize("width, height", [(2000, 1000), (900, 700),
+                                           (200, 590)])
+def test_rungs_match_single_sizes(tmp_path, smooth, width, height):
+    sourceImage = str(tmp_path / "source.argb")
+    image = Image.create(width, height, 0xFF336699)
+    image.rectangle(width // 5, height // 7, width // 2, height // 3,
+                    outline=0xFF000000, fill=0xFFFFCC00)
+    image.save(sourceImage)
+    rungs = Ladder.parse_sizes(SIZES)
+    ladder = str(tmp_path / "ladder")
+    targets = [(size, Ladder.target_for(ladder, "source.argb", size,
+                pattern)) for size, pattern in rungs]
+    results = Ladder.scale(sourceImage, targets, smooth)
+    assert [result.name for result in results] == [targetImage for _,
+            targetImage in targets]
+    for size, targetImage in targets:
+        single = str(tmp_path / "single{}.argb".format(size))
+        Ladder.scale(sourceImage, [(size, single)], smooth)
+        expected = Image.from_file(single)
+        actual = Image.from_file(targetImage)
+        assert (actual.width, actual.height) == (expected.width,
+                                                 expected.height), size
+        if smooth: # Smooth rungs are scaled from the rung before
+            assert max(actual.width, actual.height) == min(size,
+                    max(width, height))
+        else: # Subsampling's strides are whole numbers
+            assert list(actual.pixels) == list(expected.pixels)
+
+
+def test_current_rungs_are_not_saved(tmp_path):
+    sourceImage = str(tmp_path / "source.argb")
+    Image.create(300, 200, 0xFF00FF00).save(sourceImage)
+    small = str(tmp_path / "small.argb")
+    results = Ladder.scale(sourceImage, [(200, None), (100, small),
+                           (50, None)], True)
+    assert [(result.copied, result.scaled, result.name) for result in
+            results] == [(0, 1, small)]
+    assert sorted(os.listdir(str(tmp_path))) == ["small.argb",
+                                                 "source.argb"]
+
+
+def test_copies_are_converted_to_the_target_format(tmp_path):
+    sourceImage = str(tmp_path / "source.xpm")
+    image = Image.create(30, 20, 0xFF0000FF)
+    image.save(sourceImage)
+    same = str(tmp_path / "same.xpm")
+    other = str(tmp_path / "other.argb")
+    results = Ladder.scale(sourceImage, [(100, same), (50, other)])
+    assert [(result.copied, result.scaled) for result in results] == [
+            (1, 0), (1, 0)]
+    with open(sourceImage, "rb") as source, open(same, "rb") as target:
+        assert source.read() == target.read()
+    converted = Image.from_file(other)
+    assert (converted.width, converted.height) == (30, 20)
+    assert list(converted.pixels) == list(image.pixels)
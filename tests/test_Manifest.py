@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import concurrent.futures
+import os
+import Manifest
+
+
+PARAMETERS = dict(size=400, smooth=False)
+
+
+def make_files(tmp_path, count):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    names = ["image{}.xpm".format(i) for i in range(count)]
+    for name in names:
+        (source / name).write_bytes(name.encode("ascii") * 10)
+        (target / name).write_bytes(b"scaled")
+    return str(source), str(target), names
+
+
+def record_all(manifest, source, target, names):
+    # Returns how many were current; records those that weren't
+    def check(name):
+        sourceImage = os.path.join(source, name)
+        targetImage = os.path.join(target, name)
+        if manifest.is_current(sourceImage, targetImage):
+            return 1
+        manifest.record(targetImage)
+        return 0
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        return sum(executor.map(check, names))
+
+
+def test_rerun_is_current(tmp_path):
+    source, target, names = make_files(tmp_path, 200)
+    manifest = Manifest.Manifest(target, PARAMETERS)
+    assert record_all(manifest, source, target, names) == 0
+    manifest.save()
+    manifest = Manifest.Manifest(target, PARAMETERS)
+    assert record_all(manifest, source, target, names) == len(names)
+    assert manifest.current == len(names)
+    assert not manifest._pending # Only stale images are pending
+
+
+def test_changes_are_not_current(tmp_path):
+    source, target, names = make_files(tmp_path, 3)
+    manifest = Manifest.Manifest(target, PARAMETERS)
+    record_all(manifest, source, target, names)
+    manifest.save()
+    with open(os.path.join(source, names[0]), "ab") as file:
+        file.write(b"changed")
+    os.utime(os.path.join(source, names[1]), ns=(0, 0)) # Same content
+    manifest = Manifest.Manifest(target, PARAMETERS)
+    assert not manifest.is_current(os.path.join(source, names[0]),
+                                   os.path.join(target, names[0]))
+    assert manifest.is_current(os.path.join(source, names[1]),
+                               os.path.join(target, names[1]))
+    assert not Manifest.Manifest(target, dict(PARAMETERS, size=100)
+            ).is_current(os.path.join(source, names[2]),
+                         os.path.join(target, names[2]))
+    assert not Manifest.Manifest(target, PARAMETERS, force=True
+            ).is_current(os.path.join(source, names[2]),
+                         os.path.join(target, names[2]))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import array
+import random
+import pytest
+import Image
+import Image._Quantize as _Quantize
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+WIDTH = 40
+HEIGHT = 30
+
+
+def make_pixels(seed=1):
+    # A gradient with noise, and a transparent band every seventh row
+    rand = random.Random(seed)
+    pixels = array.array(Image._typecode())
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            if y % 7 == 3:
+                pixels.append(rand.getrandbits(24)) # Alpha of 0
+            else:
+                r = min(255, (x * 6) + rand.randrange(20))
+                g = min(255, (y * 8) + rand.randrange(20))
+                b = rand.randrange(256)
+                pixels.append(0xFF000000 | (r << 16) | (g << 8) | b)
+    return pixels
+
+
+@pytest.mark.parametrize("dither", [False, True])
+@pytest.mark.parametrize("colors", [1, 2, 16, 255])
+def test_colors_are_capped(colors, dither):
+    pixels = _Quantize.quantize(make_pixels(), WIDTH, HEIGHT, colors,
+                                dither)
+    solids = {color for color in pixels if color >> 24}
+    assert 1 <= len(solids) <= colors
+    assert all(color >> 24 == 0xFF for color in solids)
+
+
+@pytest.mark.parametrize("dither", [False, True])
+def test_transparent_pixels_are_kept(dither):
+    pixels = make_pixels()
+    quantized = _Quantize.quantize(pixels, WIDTH, HEIGHT, 8, dither)
+    for old, new in zip(pixels, quantized):
+        if old >> 24:
+            assert new >> 24 == 0xFF
+        else:
+            assert new == 0
+
+
+@pytest.mark.skipif(numpy is None, reason="requires numpy")
+@pytest.mark.parametrize("dither", [False, True])
+@pytest.mark.parametrize("colors", [3, 16, 64])
+def test_numpy_matches_pure_python(colors, dither):
+    pixels = make_pixels()
+    expected = _Quantize.quantize(pixels, WIDTH, HEIGHT, colors, dither)
+    assert isinstance(expected, array.array)
+    actual = _Quantize.quantize(numpy.array(pixels, dtype=numpy.uint32),
+                                WIDTH, HEIGHT, colors, dither)
+    assert isinstance(actual, numpy.ndarray)
+    assert actual.tolist() == list(expected)
+
+
+def test_image_quantize_keeps_size_and_meta():
+    image = Image.from_data(WIDTH, make_pixels())
+    image.meta["name"] = "test"
+    quantized = image.quantize(4)
+    assert (quantized.width, quantized.height) == (WIDTH, HEIGHT)
+    assert quantized.meta == image.meta
+    assert len({color for color in quantized.pixels if color >> 24}) <= 4
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import os
+import pytest
+import Image
+import Image.Raw as Raw
+
+
+def make_image(width=37, height=23):
+    image = Image.create(width, height)
+    for y in range(height):
+        for x in range(width):
+            image.set_pixel(x, y, 0xFF000000 | (x << 16) | (y << 8) |
+                            ((x * y) & 0xFF))
+    return image
+
+
+@pytest.mark.parametrize("useNumpy", [True, False])
+def test_save_over_loaded_file(tmp_path, monkeypatch, useNumpy):
+    if not useNumpy:
+        monkeypatch.setattr(Raw, "numpy", None)
+    filename = str(tmp_path / "image.argb")
+    expected = make_image()
+    expected.meta["note"] = "kept"
+    expected.save(filename)
+    image = Image.from_file(filename)
+    image.save() # To the file its pixels were loaded (mapped) from
+    image.set_pixel(0, 0, 0xFF123456)
+    image.save(filename)
+    expected.set_pixel(0, 0, 0xFF123456)
+    reloaded = Image.from_file(filename)
+    assert (reloaded.width, reloaded.height) == (expected.width,
+                                                 expected.height)
+    assert list(reloaded.pixels) == list(expected.pixels)
+    assert reloaded.meta["note"] == "kept"
+    assert os.listdir(str(tmp_path)) == ["image.argb"]
+
+
+def test_save_rows_over_file_being_read(tmp_path):
+    filename = str(tmp_path / "image.argb")
+    expected = make_image()
+    expected.save(filename)
+    Image.write_rows(filename, expected.width, expected.height,
+                     Image.iter_rows(filename))
+    assert list(Image.from_file(filename).pixels) == list(expected.pixels)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import pytest
+numpy = pytest.importorskip("numpy")
+import Scale.Resample as Resample # Must work without Scale.Fast built
+
+
+@pytest.mark.parametrize("kernel", sorted(Resample.KERNELS))
+def test_solid_color_stays_solid(kernel):
+    pixels = numpy.full(40 * 30, 0xFF336699, dtype=numpy.uint32)
+    columns, newPixels = Resample.resample(pixels, 40, 30, 0.5, 1.5,
+                                           kernel)
+    assert columns == 20
+    assert len(newPixels) == 20 * 45
+    assert set(newPixels.tolist()) == {0xFF336699}